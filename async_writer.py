@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import queue
+import threading
+from pipeline_metrics import metrics, write_point_cloud
+
+# Tells a writer thread to exit
+_STOP = object()
+
+class AsyncWriter:
+    """
+    Run output writes on background threads so processing loops do not wait on the disk.
+
+    Writes are handed over through a bounded queue: submit() returns immediately while
+    there is room and blocks once queue_size writes are pending, so a slow disk slows
+    the producer down instead of letting finished clouds pile up in memory. The first
+    write that fails is re-raised by the next submit(), flush() or close(), and later
+    writes are skipped. With more than one worker, writes may finish out of order.
+    """
+
+    def __init__(self, workers=1, queue_size=16):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if self._error is None:
+                    function, args, kwargs = item
+                    function(*args, **kwargs)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, function, *args, **kwargs):
+        """Queue function(*args, **kwargs), blocking while the queue is full."""
+        self._raise_error()
+        with metrics.stage('write_queue_wait'):
+            self._queue.put((function, args, kwargs))
+
+    def write_point_cloud(self, output_path, pcd, stage='write_pcd'):
+        """Queue an atomic PCD write (see pipeline_metrics.write_point_cloud)."""
+        self.submit(write_point_cloud, output_path, pcd, stage=stage)
+
+    def flush(self):
+        """Wait until every queued write has finished, then raise the first error if any."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self, raise_errors=True):
+        """
+        Finish the queued writes and stop the threads. With raise_errors=False, as when
+        cleaning up after another exception, a failed write is not re-raised.
+        """
+        if self._threads:
+            self._queue.join()
+            for _ in self._threads:
+                self._queue.put(_STOP)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+        if raise_errors:
+            self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Do not hide the exception that ended the with block behind a write error
+        self.close(raise_errors=exc_type is None)
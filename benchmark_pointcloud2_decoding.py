@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import time
+import numpy as np
+import sensor_msgs.point_cloud2 as pc2
+from pointcloud2_decoder import decode_point_cloud2
+from synthetic_pointclouds import make_stair_cloud, make_pointcloud2
+
+def decode_with_read_points(point_cloud_msg):
+    """The previous per-point decoding path, kept for comparison."""
+    return np.array(list(pc2.read_points(point_cloud_msg, skip_nans=True, field_names=("x", "y", "z"))))
+
+def time_decoder(decoder, msg, repeats):
+    """Return the best wall-clock time of several decoder runs."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        decoder(msg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmark(sizes, repeats=3, nan_fraction=0.05, seed=0):
+    print(f"{'points':>10} {'read_points [s]':>16} {'vectorized [s]':>15} {'speedup':>9} {'Mpts/s':>8}")
+    for size in sizes:
+        msg = make_pointcloud2(make_stair_cloud(size, rng=seed), nan_fraction=nan_fraction, rng=seed)
+
+        reference = decode_with_read_points(msg)
+        points, _ = decode_point_cloud2(msg)
+        if not np.allclose(reference, points):
+            raise RuntimeError(f"Vectorized decoder disagrees with read_points for {size} points")
+
+        t_old = time_decoder(decode_with_read_points, msg, repeats)
+        t_new = time_decoder(decode_point_cloud2, msg, repeats)
+        print(f"{size:>10} {t_old:>16.4f} {t_new:>15.5f} {t_old / t_new:>8.1f}x {size / t_new / 1e6:>8.1f}")
+
+if __name__ == "__main__":
+    run_benchmark([10_000, 100_000, 300_000])
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+import open3d as o3d
+from synthetic_pointclouds import make_labelled_frames, make_pointcloud2, write_synthetic_bag
+from pointcloud2_decoder import decode_point_cloud2
+from pcd_filter_passthrough import apply_crop_box_filter
+from pcd_downsampling import apply_voxel_downsampling
+from pca_on_pcd_saving_to_csv import apply_pca_to_point_cloud
+from pca_feature_engine import compute_features
+from voxel_grid import voxel_downsample_batch
+
+# Points per frame for each benchmark size
+SIZES = {'small': 10_000, 'medium': 100_000, 'large': 300_000}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+def _status_mb(field):
+    """A memory field of /proc/self/status in MB, or None where /proc is not available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """Restart the process's peak RSS (VmHWM) from its current RSS; needs Linux 4.0 or later."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def measure(function, repeats):
+    """
+    Run function repeats times. Returns the median wall-clock latency in seconds and the
+    memory of the runs: the peak RSS reached while they ran and its growth over the RSS
+    before them, in MB. ru_maxrss cannot be used, since it never goes down and would
+    report the peak of an earlier stage; both are None where the peak cannot be reset.
+    """
+    start_rss = _status_mb('VmRSS') if reset_peak_rss() else None
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        latencies.append(time.perf_counter() - start)
+    peak_rss = _status_mb('VmHWM') if start_rss is not None else None
+    memory = {'stage_peak_rss_mb': peak_rss,
+              'stage_rss_growth_mb': peak_rss - start_rss if peak_rss is not None else None}
+    return float(np.median(latencies)), memory
+
+def to_o3d(points):
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
+    return pcd
+
+def benchmark_frame_stages(size_name, num_points, num_frames, repeats, rng):
+    """Per-frame stages on synthetic stair/floor clouds of one size."""
+    frames, _ = make_labelled_frames(num_frames, num_points, rng=rng)
+    messages = [make_pointcloud2(points, nan_fraction=0.02, rng=rng) for points in frames]
+    pcds = [to_o3d(points) for points in frames]
+    total_points = num_frames * num_points
+    bounds = {'x': (0.0, 2.5), 'y': (-0.7, 0.7), 'z': (-1.0, 0.3)}
+
+    stages = {
+        'decode_pointcloud2': lambda: [decode_point_cloud2(msg) for msg in messages],
+        'crop_box_filter': lambda: [apply_crop_box_filter(pcd, bounds) for pcd in pcds],
+        'voxel_downsampling': lambda: [apply_voxel_downsampling(pcd, 0.05) for pcd in pcds],
+        'voxel_grid_batched': lambda: voxel_downsample_batch(frames, 0.05),
+        'pca_per_frame': lambda: [apply_pca_to_point_cloud(pcd) for pcd in pcds],
+        'pca_batched': lambda: compute_features(frames),
+    }
+    results = {}
+    for stage, function in stages.items():
+        latency, memory = measure(function, repeats)
+        results[f"{stage}/{size_name}"] = {
+            'latency_s': latency,
+            'frames_per_s': num_frames / latency,
+            'points_per_s': total_points / latency,
+            **memory,
+        }
+    return results
+
+def benchmark_training(num_frames, num_points, repeats, rng):
+    """Fit and score the default classifiers on features of synthetic frames."""
+    from sklearn.preprocessing import StandardScaler
+    from train_test_model import MODEL_SEARCH_SPACE
+
+    frames, labels = make_labelled_frames(num_frames, num_points, rng=rng)
+    features = compute_features(frames)
+    X = StandardScaler().fit_transform(np.column_stack(list(features.values())))
+    y = np.array(labels)
+
+    results = {}
+    for model_name, (estimator, grid) in MODEL_SEARCH_SPACE.items():
+        params = {name: values[0] for name, values in grid.items()}
+        latency, memory = measure(lambda: estimator(**params).fit(X, y).predict(X), repeats)
+        results[f"train_{model_name.lower().replace(' ', '_')}"] = {
+            'latency_s': latency,
+            'frames_per_s': num_frames / latency,
+            **memory,
+        }
+    return results
+
+def benchmark_bags(num_frames, num_points, repeats, rng):
+    """Bag conversion and slicing on a small synthetic bag written locally."""
+    try:
+        import rosbag  # noqa: F401
+    except ImportError:
+        print("Skipping bag benchmarks: the rosbag Python package is not installed")
+        return {}
+    from rosbag_to_pcd_converter import process_rosbag
+    from rosbag_division import slice_rosbag
+
+    work_dir = tempfile.mkdtemp(prefix="syde675_bench_")
+    try:
+        bag_path = write_synthetic_bag(os.path.join(work_dir, "synthetic.bag"), num_frames, num_points, rng=rng)
+        bag_bytes = os.path.getsize(bag_path)
+        output_dir = os.path.join(work_dir, "pcd")
+        segments = [os.path.join(work_dir, f"part{i}.bag") for i in range(3)]
+        duration = num_frames / 10.0
+
+        results = {}
+        latency, memory = measure(lambda: process_rosbag(bag_path, "/scan_3D", output_dir, progress_interval=0),
+                                  repeats)
+        results['convert_rosbag'] = {'latency_s': latency, 'frames_per_s': num_frames / latency,
+                                     'points_per_s': num_frames * num_points / latency, **memory}
+        latency, memory = measure(lambda: slice_rosbag(bag_path, [duration / 3, 2 * duration / 3], segments), repeats)
+        results['slice_rosbag'] = {'latency_s': latency, 'frames_per_s': num_frames / latency,
+                                   'mb_per_s': bag_bytes / 1e6 / latency, **memory}
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Print latency changes against the baseline and return the stages slower than tolerance allows."""
+    regressions = []
+    print(f"{'stage':<40} {'baseline [ms]':>14} {'current [ms]':>13} {'change':>8}")
+    for stage, metrics in sorted(results.items()):
+        if stage not in baseline:
+            print(f"{stage:<40} {'-':>14} {metrics['latency_s'] * 1e3:>13.2f} {'new':>8}")
+            continue
+        before, after = baseline[stage]['latency_s'], metrics['latency_s']
+        change = after / before - 1.0
+        flag = " REGRESSION" if change > tolerance else ""
+        print(f"{stage:<40} {before * 1e3:>14.2f} {after * 1e3:>13.2f} {change:>+7.0%}{flag}")
+        if change > tolerance:
+            regressions.append(stage)
+    return regressions
+
+def _format_mb(value, width):
+    return f"{value:>{width}.0f}" if value is not None else f"{'-':>{width}}"
+
+def print_results(results):
+    print(f"{'stage':<40} {'latency [ms]':>13} {'frames/s':>10} {'Mpoints/s':>10} "
+          f"{'stage peak RSS [MB]':>20} {'RSS growth [MB]':>16}")
+    for stage, metrics in sorted(results.items()):
+        points_per_s = metrics.get('points_per_s')
+        mpoints = f"{points_per_s / 1e6:>10.2f}" if points_per_s else f"{'-':>10}"
+        print(f"{stage:<40} {metrics['latency_s'] * 1e3:>13.2f} {metrics['frames_per_s']:>10.1f} "
+              f"{mpoints} {_format_mb(metrics.get('stage_peak_rss_mb'), 20)} "
+              f"{_format_mb(metrics.get('stage_rss_growth_mb'), 16)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the point cloud pipeline on synthetic data.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated subset of {sorted(SIZES)}")
+    parser.add_argument("--frames", type=int, default=20, help="Frames per stage run")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip-training", action="store_true")
+    parser.add_argument("--skip-bags", action="store_true")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed latency increase before flagging")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = {}
+    for size_name in args.sizes.split(','):
+        results.update(benchmark_frame_stages(size_name, SIZES[size_name], args.frames, args.repeats, rng))
+    if not args.skip_training:
+        results.update(benchmark_training(400, 5_000, args.repeats, rng))
+    if not args.skip_bags:
+        results.update(benchmark_bags(args.frames, SIZES['small'], args.repeats, rng))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
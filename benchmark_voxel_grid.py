@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import time
+import numpy as np
+import open3d as o3d
+from voxel_grid import voxel_downsample_batch, voxel_downsample_to_target
+from synthetic_pointclouds import make_stair_cloud
+
+def downsample_with_open3d(point_sets, voxel_size):
+    """The per-cloud Open3D path used by pcd_downsampling.py, kept for comparison."""
+    results = []
+    for points in point_sets:
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(points)
+        results.append(np.asarray(pcd.voxel_down_sample(voxel_size).points))
+    return results
+
+def sorted_rows(points):
+    return points[np.lexsort(points.T[::-1])]
+
+def time_function(function, repeats):
+    """Return the best wall-clock time of several runs."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmark(sizes, num_frames=20, voxel_size=0.05, target_points=2000, repeats=3, seed=0):
+    print(f"{'points':>10} {'frames':>7} {'open3d [s]':>11} {'numpy batch [s]':>16} {'speedup':>9} {'target [s]':>11}")
+    rng = np.random.default_rng(seed)
+    for size in sizes:
+        point_sets = [make_stair_cloud(size, rng=rng) for _ in range(num_frames)]
+
+        reference = downsample_with_open3d(point_sets, voxel_size)
+        batched = voxel_downsample_batch(point_sets, voxel_size)
+        for expected, actual in zip(reference, batched):
+            # Open3D returns the voxels in hash-map order, so compare them sorted
+            if len(expected) != len(actual) or not np.allclose(sorted_rows(expected), sorted_rows(actual), atol=1e-6):
+                raise RuntimeError(f"Batched voxel grid disagrees with voxel_down_sample for {size} points")
+
+        t_open3d = time_function(lambda: downsample_with_open3d(point_sets, voxel_size), repeats)
+        t_batch = time_function(lambda: voxel_downsample_batch(point_sets, voxel_size), repeats)
+        t_target = time_function(lambda: voxel_downsample_to_target(point_sets, target_points), repeats)
+        print(f"{size:>10} {num_frames:>7} {t_open3d:>11.4f} {t_batch:>16.4f} {t_open3d / t_batch:>8.1f}x {t_target:>11.4f}")
+
+if __name__ == "__main__":
+    run_benchmark([10_000, 100_000, 300_000])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import uuid
+import shutil
+import argparse
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# Feature columns are stored as float64 unless listed here
+COLUMN_TYPES = {'label': pa.int8()}
+FORMAT_EXTENSIONS = {'feather': '.feather', 'parquet': '.parquet'}
+
+def features_to_table(features):
+    """
+    Build a typed Arrow table from a list of row dicts or a dict of column arrays.
+    """
+    if isinstance(features, list):
+        columns = {name: [row[name] for row in features] for name in (features[0] if features else {})}
+    else:
+        columns = dict(features)
+    arrays, names = [], []
+    for name, values in columns.items():
+        arrays.append(pa.array(values, type=COLUMN_TYPES.get(name, pa.float64())))
+        names.append(name)
+    return pa.Table.from_arrays(arrays, names=names)
+
+def partition_directory(store_dir, partition):
+    return os.path.join(os.path.expanduser(store_dir), f"partition={partition}")
+
+def write_feature_partition(features, store_dir, partition, file_format='feather', mode='append'):
+    """
+    Write one chunk of features into a partition (for example one bag or directory).
+    mode='append' adds a new chunk file next to the existing ones; mode='overwrite'
+    replaces the partition. Chunks are written to a temporary name and renamed, so
+    readers never see a partially written file.
+    """
+    table = features_to_table(features)
+    directory = partition_directory(store_dir, partition)
+    if mode == 'overwrite' and os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory, exist_ok=True)
+
+    extension = FORMAT_EXTENSIONS[file_format]
+    output_path = os.path.join(directory, f"part-{uuid.uuid4().hex}{extension}")
+    tmp_path = os.path.join(directory, f".{os.path.basename(output_path)}.tmp")
+    if file_format == 'feather':
+        # Uncompressed Arrow IPC can be memory-mapped without decoding
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+    else:
+        pq.write_table(table, tmp_path)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def list_partitions(store_dir):
+    """Names of the partitions in a feature store."""
+    pattern = os.path.join(os.path.expanduser(store_dir), "partition=*")
+    return sorted(os.path.basename(path).split('=', 1)[1] for path in glob.glob(pattern) if os.path.isdir(path))
+
+def _read_chunk(path, columns, memory_map):
+    if path.endswith(FORMAT_EXTENSIONS['feather']):
+        return feather.read_table(path, columns=columns, memory_map=memory_map)
+    return pq.read_table(path, columns=columns, memory_map=memory_map)
+
+def load_feature_table(store_dir, columns=None, partitions=None, memory_map=True, include_partition=False):
+    """
+    Read a feature store as one Arrow table, loading only the requested columns and
+    partitions. Feather chunks are memory-mapped, so untouched columns are never read.
+    """
+    tables = []
+    for partition in partitions or list_partitions(store_dir):
+        directory = partition_directory(store_dir, partition)
+        for path in sorted(glob.glob(os.path.join(directory, "part-*"))):
+            table = _read_chunk(path, columns, memory_map)
+            if include_partition:
+                table = table.append_column('partition', pa.array([partition] * table.num_rows, pa.string()))
+            tables.append(table)
+    if not tables:
+        return pa.table({})
+    return pa.concat_tables(tables)
+
+def load_features(store_dir, columns=None, partitions=None, memory_map=True, include_partition=False):
+    """Read a feature store into a pandas DataFrame (see load_feature_table)."""
+    return load_feature_table(store_dir, columns, partitions, memory_map, include_partition).to_pandas()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a columnar feature store or import a CSV into it.")
+    parser.add_argument("store_dir")
+    parser.add_argument("--import-csv", help="CSV produced by pca_on_pcd_saving_to_csv.py to import")
+    parser.add_argument("--partition", default="imported")
+    parser.add_argument("--format", choices=sorted(FORMAT_EXTENSIONS), default="feather")
+    args = parser.parse_args()
+
+    if args.import_csv:
+        import pyarrow.csv as pa_csv
+        table = pa_csv.read_csv(os.path.expanduser(args.import_csv))
+        write_feature_partition(table.to_pydict(), args.store_dir, args.partition, args.format, mode='overwrite')
+    for partition in list_partitions(args.store_dir):
+        table = load_feature_table(args.store_dir, partitions=[partition])
+        print(f"{partition}: {table.num_rows} rows, {table.num_columns} columns")
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import hashlib
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from frame_store import FrameStore, take_frame_stores, UNLABELLED, _frame_number
+from pipeline_metrics import metrics, read_point_cloud
+
+MANIFEST_COLUMNS = ['path', 'source', 'bag', 'frame', 'timestamp', 'label', 'num_points']
+DEFAULT_MANIFEST = 'frame_manifest.feather'
+# Marks the end of the prefetch queue
+_END_OF_STREAM = object()
+
+def pcd_header_point_count(pcd_file):
+    """Number of points declared in a PCD file's header, read without loading the points."""
+    width = height = None
+    with open(pcd_file, 'rb') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == b'POINTS':
+                return int(fields[1])
+            if fields[0] == b'WIDTH':
+                width = int(fields[1])
+            elif fields[0] == b'HEIGHT':
+                height = int(fields[1])
+            elif fields[0] == b'DATA':
+                break
+    return (width or 0) * (height or 1)
+
+def build_manifest(root_dir, label_function=None):
+    """
+    Index every frame below root_dir: the per-frame PCD files of each bag directory and
+    the frames of each frame store. Point counts come from the PCD headers and store
+    offsets, so no points are loaded. Frames are labelled by the label stored with them
+    or else by label_function(bag), which defaults to determine_label of the PCA script.
+    Aggregated *_grand.pcd files and hidden temporary files are left out. Paths are
+    stored absolute, so a cached manifest works from any working directory.
+    """
+    if label_function is None:
+        from pca_on_pcd_saving_to_csv import determine_label as label_function
+    root_dir = os.path.abspath(os.path.expanduser(root_dir))
+    rows = []
+    for subdir, dirs, files in os.walk(root_dir):
+        dirs.sort()
+        for store_path in take_frame_stores(subdir, dirs):
+            store = FrameStore(store_path)
+            bag_label = label_function(store.name)
+            for index, (timestamp, label, count) in enumerate(zip(store.timestamps, store.labels, store.point_counts)):
+                rows.append((store_path, 'store', store.name, index, float(timestamp),
+                             int(label) if label != UNLABELLED else bag_label, int(count)))
+        relative = os.path.relpath(subdir, root_dir)
+        bag = os.path.basename(root_dir) if relative == '.' else relative.split(os.sep)[0]
+        for filename in sorted(files):
+            if not filename.endswith('.pcd') or filename.startswith('.') or filename.endswith('_grand.pcd'):
+                continue
+            pcd_file = os.path.join(subdir, filename)
+            rows.append((pcd_file, 'pcd', bag, _frame_number(filename), float('nan'),
+                         label_function(bag), pcd_header_point_count(pcd_file)))
+    manifest = pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+    manifest = manifest.sort_values(['bag', 'source', 'frame', 'path'], kind='stable').reset_index(drop=True)
+    return manifest.astype({'frame': np.int64, 'label': np.int8, 'num_points': np.int64})
+
+def save_manifest(manifest, manifest_path):
+    tmp_path = os.path.join(os.path.dirname(manifest_path), f".{os.path.basename(manifest_path)}.tmp")
+    manifest.reset_index(drop=True).to_feather(tmp_path)
+    os.replace(tmp_path, manifest_path)
+
+def load_manifest(manifest_path):
+    return pd.read_feather(manifest_path)
+
+def bag_split_value(bag, seed=0):
+    """Stable pseudo-random number in [0, 1) for a bag name, independent of the other bags."""
+    digest = hashlib.sha1(f"{seed}:{bag}".encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+class FrameDataset:
+    """
+    Lazily loaded frames described by a manifest (see build_manifest).
+
+    Nothing is read until iteration: PCD files are opened one at a time and frame
+    store frames are zero-copy views of the memory-mapped store. Datasets can be
+    split by bag, sharded across workers and iterated with a shuffle buffer and a
+    background prefetch thread; all of these only select or reorder manifest rows.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest.reset_index(drop=True)
+        self._stores = {}
+
+    @classmethod
+    def from_directory(cls, root_dir, manifest_path=None, rebuild=False, label_function=None):
+        """Open the frames below root_dir, building the manifest on first use and caching it."""
+        root_dir = os.path.expanduser(root_dir)
+        manifest_path = os.path.expanduser(manifest_path or os.path.join(root_dir, DEFAULT_MANIFEST))
+        if os.path.exists(manifest_path) and not rebuild:
+            return cls(load_manifest(manifest_path))
+        manifest = build_manifest(root_dir, label_function)
+        save_manifest(manifest, manifest_path)
+        metrics.log(f"Indexed {len(manifest)} frames of {manifest['bag'].nunique()} bag(s) into {manifest_path}")
+        return cls(manifest)
+
+    def __len__(self):
+        return len(self.manifest)
+
+    @property
+    def bags(self):
+        return sorted(self.manifest['bag'].unique())
+
+    def subset(self, mask_or_indices):
+        return FrameDataset(self.manifest[mask_or_indices] if isinstance(mask_or_indices, pd.Series)
+                            else self.manifest.iloc[mask_or_indices])
+
+    def split_by_bag(self, test_fraction=0.2, seed=0):
+        """
+        Deterministic (train, test) split that keeps every bag on one side, so frames of
+        one recording never leak between training and evaluation. A bag's side depends
+        only on its name and the seed, so adding bags does not move the existing ones.
+        """
+        in_test = self.manifest['bag'].map(lambda bag: bag_split_value(bag, seed) < test_fraction).astype(bool)
+        return self.subset(~in_test), self.subset(in_test)
+
+    def shard(self, index, count):
+        """The index-th of count disjoint shards, e.g. one per worker process."""
+        return self.subset(np.arange(index, len(self), count))
+
+    def load(self, position):
+        """Points of the frame in the given manifest row."""
+        row = self.manifest.iloc[position]
+        if row['source'] == 'store':
+            store = self._stores.get(row['path'])
+            if store is None:
+                store = self._stores[row['path']] = FrameStore(row['path'])
+            return store.frame(int(row['frame']))
+        return np.asarray(read_point_cloud(row['path']).points)
+
+    def _ordered(self, shuffle_buffer, seed):
+        """Manifest positions in file order, locally shuffled through a buffer."""
+        if not shuffle_buffer:
+            yield from range(len(self))
+            return
+        rng = np.random.default_rng(seed)
+        buffer = []
+        for position in range(len(self)):
+            if len(buffer) < shuffle_buffer:
+                buffer.append(position)
+                continue
+            slot = rng.integers(len(buffer))
+            yield buffer[slot]
+            buffer[slot] = position
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _load_all(self, positions):
+        for position in positions:
+            yield position, self.load(position)
+
+    def _prefetched(self, positions, prefetch):
+        items = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for item in self._load_all(positions):
+                    if stop.is_set():
+                        break
+                    items.put(item)
+            except Exception as e:
+                items.put(e)
+            finally:
+                items.put(_END_OF_STREAM)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = items.get()
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop.set()
+            while producer.is_alive():
+                try:
+                    items.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def iterate(self, shuffle_buffer=0, seed=None, prefetch=0):
+        """
+        Yield (points, manifest row) pairs one frame at a time. shuffle_buffer randomizes
+        the order within a window of that many frames while keeping reads mostly
+        sequential; prefetch loads up to that many frames ahead on a background thread.
+        """
+        positions = self._ordered(shuffle_buffer, seed)
+        frames = self._prefetched(positions, prefetch) if prefetch else self._load_all(positions)
+        for position, points in frames:
+            yield points, self.manifest.iloc[position]
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iter_batches(self, batch_size, **options):
+        """Yield (list of points, manifest rows DataFrame) batches; options as for iterate()."""
+        points_batch, rows = [], []
+        for points, row in self.iterate(**options):
+            points_batch.append(points)
+            rows.append(row)
+            if len(points_batch) == batch_size:
+                yield points_batch, pd.DataFrame(rows)
+                points_batch, rows = [], []
+        if points_batch:
+            yield points_batch, pd.DataFrame(rows)
+
+def compute_dataset_features(dataset, batch_size=256, prefetch=64):
+    """PCA feature rows (with label and bag) of every frame, streamed batch by batch."""
+    from pca_feature_engine import FEATURE_COLUMNS, compute_features
+
+    tables = []
+    for point_sets, rows in dataset.iter_batches(batch_size, prefetch=prefetch):
+        with metrics.stage('pca_features', points_in=sum(len(points) for points in point_sets)):
+            features = compute_features(point_sets)
+        table = pd.DataFrame({'label': rows['label'].to_numpy()})
+        for name in FEATURE_COLUMNS:
+            table[name] = features[name]
+        table['bag'] = rows['bag'].to_numpy()
+        tables.append(table)
+    if not tables:
+        # Keep the columns, so callers can group an empty result by bag
+        return pd.DataFrame(columns=['label', *FEATURE_COLUMNS, 'bag'])
+    return pd.concat(tables, ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index converted frames and stream features from the index.")
+    parser.add_argument("root_dir", help="Directory of converted bags (PCD directories and/or frame stores)")
+    parser.add_argument("--manifest", help=f"Manifest path, {DEFAULT_MANIFEST} in root_dir by default")
+    parser.add_argument("--rebuild", action="store_true", help="Rescan root_dir even if a manifest exists")
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--features-store", help="Compute PCA features of all frames into this feature store")
+    args = parser.parse_args()
+
+    dataset = FrameDataset.from_directory(args.root_dir, args.manifest, rebuild=args.rebuild)
+    train, test = dataset.split_by_bag(args.test_fraction, args.seed)
+    print(f"{len(dataset)} frames, {int(dataset.manifest['num_points'].sum())} points in {len(dataset.bags)} bag(s)")
+    print(dataset.manifest.groupby(['bag', 'label']).size().rename('frames').to_string())
+    print(f"train: {len(train)} frames of {train.bags}")
+    print(f"test: {len(test)} frames of {test.bags}")
+
+    if args.features_store:
+        from feature_store import write_feature_partition
+        features = compute_dataset_features(dataset)
+        for bag, rows in features.groupby('bag'):
+            write_feature_partition(rows.drop(columns='bag').to_dict('list'), args.features_store, bag, mode='overwrite')
+        print(f"Saved features of {len(features)} frames to {args.features_store}")
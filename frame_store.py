@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import glob
+import argparse
+import numpy as np
+
+# A frame store is a directory named <bag>.frames holding all frames of one bag
+FRAME_STORE_SUFFIX = '.frames'
+POINTS_FILE = 'points.bin'
+INDEX_FILE = 'index.npz'
+UNLABELLED = -1
+
+def is_frame_store(path):
+    """A frame store is complete once its index has been written."""
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+def frame_store_name(path):
+    """Bag name of a frame store, e.g. 'stairs_01' for '.../stairs_01.frames'."""
+    name = os.path.basename(os.path.normpath(path))
+    return name[:-len(FRAME_STORE_SUFFIX)] if name.endswith(FRAME_STORE_SUFFIX) else name
+
+def find_frame_stores(root_dir):
+    """List every frame store below root_dir."""
+    stores = []
+    for subdir, dirs, files in os.walk(os.path.expanduser(root_dir)):
+        if is_frame_store(subdir):
+            stores.append(subdir)
+            dirs[:] = []
+    return sorted(stores)
+
+def take_frame_stores(subdir, dirs):
+    """
+    For use inside os.walk: remove the frame stores from dirs, so the walk does not
+    descend into them, and return their paths.
+    """
+    stores = [name for name in dirs if is_frame_store(os.path.join(subdir, name))]
+    for name in stores:
+        dirs.remove(name)
+    return [os.path.join(subdir, name) for name in sorted(stores)]
+
+class FrameStoreWriter:
+    """
+    Append frames to a new frame store.
+
+    Points are written back to back into one flat binary file, so a bag needs a
+    single file handle instead of one PCD file per message. The index (frame offsets,
+    timestamps, labels and names) is written when the writer is closed, to a temporary
+    name that is then renamed; a store without an index is incomplete and is ignored.
+    Leaving a with block through an exception, or calling abort(), releases the points
+    file without writing the index.
+    """
+
+    def __init__(self, store_dir, dtype=np.float32):
+        self.store_dir = os.path.expanduser(store_dir)
+        self.dtype = np.dtype(dtype)
+        os.makedirs(self.store_dir, exist_ok=True)
+        index_path = os.path.join(self.store_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        self._points_file = open(os.path.join(self.store_dir, POINTS_FILE), 'wb')
+        self.offsets = [0]
+        self.timestamps = []
+        self.labels = []
+        self.names = []
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, points, timestamp=float('nan'), label=UNLABELLED, name=None):
+        """Append one (N, 3) frame and return its index."""
+        points = np.ascontiguousarray(points, dtype=self.dtype).reshape(-1, 3)
+        points.tofile(self._points_file)
+        index = len(self)
+        self.offsets.append(self.offsets[-1] + len(points))
+        self.timestamps.append(timestamp)
+        self.labels.append(label)
+        self.names.append(name if name is not None else f"{frame_store_name(self.store_dir)}_{index}")
+        return index
+
+    def abort(self):
+        """Close the points file without writing the index, leaving the store incomplete."""
+        self._points_file.close()
+
+    def close(self):
+        if self._points_file.closed:
+            return
+        self._points_file.close()
+        tmp_path = os.path.join(self.store_dir, f".{INDEX_FILE}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f,
+                     offsets=np.asarray(self.offsets, dtype=np.int64),
+                     timestamps=np.asarray(self.timestamps, dtype=np.float64),
+                     labels=np.asarray(self.labels, dtype=np.int8),
+                     names=np.asarray(self.names, dtype=np.str_),
+                     dtype=np.asarray(self.dtype.str))
+        os.replace(tmp_path, os.path.join(self.store_dir, INDEX_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def store_files(store_dir):
+    """
+    Stage cache outputs of a frame store: its index, its points file and, last, the store
+    directory itself, so that pruning with delete_outputs removes the store as a unit.
+    """
+    return [os.path.join(store_dir, INDEX_FILE), os.path.join(store_dir, POINTS_FILE), store_dir]
+
+class FrameStore:
+    """
+    Read-only view of a frame store.
+
+    The point file is memory-mapped once; frame(i) slices it between two offsets,
+    so reading any frame is O(1) and returns a view without copying. Frames are
+    float32 (N, 3) arrays and must not be modified.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = os.path.expanduser(store_dir)
+        with np.load(os.path.join(self.store_dir, INDEX_FILE)) as index:
+            self.offsets = index['offsets']
+            self.timestamps = index['timestamps']
+            self.labels = index['labels']
+            self.names = index['names']
+            self.dtype = np.dtype(str(index['dtype']))
+        num_points = int(self.offsets[-1])
+        if num_points:
+            self.points = np.memmap(os.path.join(self.store_dir, POINTS_FILE), dtype=self.dtype,
+                                    mode='r', shape=(num_points, 3))
+        else:
+            self.points = np.empty((0, 3), dtype=self.dtype)
+
+    @property
+    def name(self):
+        return frame_store_name(self.store_dir)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.store_dir, INDEX_FILE)
+
+    @property
+    def point_counts(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame(self, index):
+        return self.points[self.offsets[index]:self.offsets[index + 1]]
+
+    def __getitem__(self, index):
+        return self.frame(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.frame(index)
+
+    def to_point_cloud(self, index):
+        """Frame as an Open3D point cloud (this copies the points)."""
+        import open3d as o3d
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(self.frame(index).astype(np.float64))
+        return pcd
+
+def transform_frame_store(input_dir, output_dir, function, batch_size=None):
+    """
+    Write function(points) of every frame of a store into a new store, keeping the
+    timestamps, labels and names. With batch_size set, function instead receives a
+    list of up to batch_size frames and returns the list of results.
+    Returns the number of points read and written.
+    """
+    store = FrameStore(input_dir)
+    points_in = points_out = 0
+    step = batch_size or 1
+    with FrameStoreWriter(output_dir, dtype=store.dtype) as writer:
+        for start in range(0, len(store), step):
+            frames = [store.frame(index) for index in range(start, min(start + step, len(store)))]
+            results = function(frames) if batch_size else [function(frames[0])]
+            for index, (points, result) in enumerate(zip(frames, results), start):
+                writer.append(result, store.timestamps[index], store.labels[index], store.names[index])
+                points_in += len(points)
+                points_out += len(result)
+    return points_in, points_out
+
+def export_pcd(store_dir, output_dir):
+    """Write every frame of a store as <name>.pcd, the layout of rosbag_to_pcd_converter.py."""
+    import open3d as o3d
+    store = FrameStore(store_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    for index in range(len(store)):
+        o3d.io.write_point_cloud(os.path.join(output_dir, f"{store.names[index]}.pcd"), store.to_point_cloud(index))
+    return len(store)
+
+def _frame_number(path):
+    match = re.search(r'_(\d+)\.pcd$', path)
+    return int(match.group(1)) if match else -1
+
+def import_pcd_directory(pcd_dir, store_dir, label=UNLABELLED):
+    """
+    Pack the per-frame PCD files of one bag directory into a frame store, in frame order.
+    The aggregated *_grand.pcd file is left out.
+    """
+    import open3d as o3d
+    pcd_files = [path for path in glob.glob(os.path.join(os.path.expanduser(pcd_dir), '*.pcd'))
+                 if not path.endswith('_grand.pcd')]
+    pcd_files.sort(key=lambda path: (_frame_number(path), path))
+    with FrameStoreWriter(store_dir) as writer:
+        for pcd_file in pcd_files:
+            points = np.asarray(o3d.io.read_point_cloud(pcd_file).points)
+            writer.append(points, label=label, name=os.path.splitext(os.path.basename(pcd_file))[0])
+    return len(pcd_files)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect frame stores or convert them from and to PCD files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info", help="Summarize the frame stores below a directory")
+    info_parser.add_argument("root_dir")
+    export_parser = subparsers.add_parser("export", help="Write a store's frames as PCD files")
+    export_parser.add_argument("store_dir")
+    export_parser.add_argument("output_dir")
+    import_parser = subparsers.add_parser("import", help="Pack a directory of PCD files into a store")
+    import_parser.add_argument("pcd_dir")
+    import_parser.add_argument("store_dir")
+    import_parser.add_argument("--label", type=int, default=UNLABELLED)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        for store_dir in find_frame_stores(args.root_dir):
+            store = FrameStore(store_dir)
+            size_mb = os.path.getsize(os.path.join(store_dir, POINTS_FILE)) / 1e6
+            print(f"{store.name}: {len(store)} frames, {int(store.offsets[-1])} points, {size_mb:.1f} MB")
+    elif args.command == "export":
+        print(f"Exported {export_pcd(args.store_dir, args.output_dir)} frame(s) to {args.output_dir}")
+    else:
+        print(f"Imported {import_pcd_directory(args.pcd_dir, args.store_dir, args.label)} frame(s) into {args.store_dir}")
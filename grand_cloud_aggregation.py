@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import open3d as o3d
+
+# Voxel indices are packed into one int64 key with this many bits per axis
+_KEY_BITS = 21
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+
+def pack_voxel_keys(voxel_indices):
+    """
+    Pack (N, 3) integer voxel indices into int64 keys that sort like the index tuples.
+    Each axis may span +/- 2**20 voxels around the origin.
+    """
+    shifted = voxel_indices.astype(np.int64) + _KEY_OFFSET
+    if shifted.size and (shifted.min() < 0 or shifted.max() >= (1 << _KEY_BITS)):
+        raise ValueError("Point cloud extent is too large for the voxel size")
+    return (shifted[:, 0] << (2 * _KEY_BITS)) | (shifted[:, 1] << _KEY_BITS) | shifted[:, 2]
+
+class GrandCloudAccumulator:
+    """
+    Accumulate frames into one aggregated cloud while they stream in.
+
+    Without a voxel size, points are copied into fixed-size preallocated chunks and
+    concatenated once at the end, giving the same cloud as repeated `grand_pcd += pcd`
+    without reallocating on every frame. With a voxel size, each frame is merged into
+    a running per-voxel centroid, so memory is bounded by the number of occupied voxels
+    rather than by the length of the recording. Reduced frames are buffered and merged
+    into the running set in one pass once they outnumber it, so each voxel is merged
+    O(log n) times and the total cost stays close to linear in the recording length.
+    """
+
+    def __init__(self, voxel_size=None, chunk_points=1_000_000):
+        self.voxel_size = voxel_size
+        self.chunk_points = chunk_points
+        self.num_frames = 0
+        self.num_points_in = 0
+        self._chunks = []
+        self._chunk_fill = 0
+        self._keys = np.empty(0, dtype=np.int64)
+        self._sums = np.empty((0, 3), dtype=np.float64)
+        self._counts = np.empty(0, dtype=np.int64)
+        # Per-frame (keys, sums, counts) not yet merged into the running set
+        self._pending = []
+        self._pending_size = 0
+
+    def add(self, points):
+        """Add one frame given as an (N, 3) array or an Open3D PointCloud."""
+        if isinstance(points, o3d.geometry.PointCloud):
+            points = np.asarray(points.points)
+        self.num_frames += 1
+        self.num_points_in += len(points)
+        if len(points) == 0:
+            return
+        if self.voxel_size:
+            self._add_voxelized(points)
+        else:
+            self._add_raw(points)
+
+    def _add_raw(self, points):
+        start = 0
+        while start < len(points):
+            if not self._chunks or self._chunk_fill == self.chunk_points:
+                self._chunks.append(np.empty((self.chunk_points, 3), dtype=np.float64))
+                self._chunk_fill = 0
+            count = min(len(points) - start, self.chunk_points - self._chunk_fill)
+            self._chunks[-1][self._chunk_fill:self._chunk_fill + count] = points[start:start + count]
+            self._chunk_fill += count
+            start += count
+
+    def _add_voxelized(self, points):
+        keys = pack_voxel_keys(np.floor(points / self.voxel_size))
+        frame_keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+        frame_counts = np.bincount(inverse, minlength=len(frame_keys))
+        frame_sums = np.column_stack([np.bincount(inverse, weights=points[:, axis], minlength=len(frame_keys))
+                                      for axis in range(3)])
+        self._pending.append((frame_keys, frame_sums, frame_counts))
+        self._pending_size += len(frame_keys)
+        # Merging only once the buffer outgrows the running set doubles the interval
+        # between merges, instead of copying the whole set for every frame
+        if self._pending_size > len(self._keys):
+            self._merge_pending()
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([self._keys] + [frame[0] for frame in self._pending])
+        sums = np.concatenate([self._sums] + [frame[1] for frame in self._pending])
+        counts = np.concatenate([self._counts] + [frame[2] for frame in self._pending])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+        self._counts = np.bincount(inverse, weights=counts, minlength=len(self._keys)).astype(np.int64)
+        self._sums = np.column_stack([np.bincount(inverse, weights=sums[:, axis], minlength=len(self._keys))
+                                      for axis in range(3)])
+        self._pending = []
+        self._pending_size = 0
+
+    @property
+    def num_points(self):
+        """Number of points the aggregated cloud currently holds."""
+        if self.voxel_size:
+            self._merge_pending()
+            return len(self._keys)
+        if not self._chunks:
+            return 0
+        return (len(self._chunks) - 1) * self.chunk_points + self._chunk_fill
+
+    def to_numpy(self):
+        """Return the aggregated points as one contiguous (N, 3) array."""
+        if self.voxel_size:
+            self._merge_pending()
+            return self._sums / self._counts[:, None]
+        if not self._chunks:
+            return np.empty((0, 3), dtype=np.float64)
+        return np.concatenate(self._chunks[:-1] + [self._chunks[-1][:self._chunk_fill]])
+
+    def to_point_cloud(self):
+        """Return the aggregated points as an Open3D PointCloud."""
+        grand_pcd = o3d.geometry.PointCloud()
+        grand_pcd.points = o3d.utility.Vector3dVector(self.to_numpy())
+        return grand_pcd
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import math
+import numpy as np
+from grand_cloud_aggregation import pack_voxel_keys
+
+def pose_from_message(msg):
+    """
+    (position, orientation quaternion) of a nav_msgs/Odometry or geometry_msgs/PoseStamped
+    message, as numpy arrays (x, y, z) and (x, y, z, w).
+    """
+    pose = msg.pose.pose if hasattr(msg.pose, 'pose') else msg.pose
+    position = np.array([pose.position.x, pose.position.y, pose.position.z])
+    orientation = np.array([pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w])
+    return position, orientation
+
+def rotation_angle(q1, q2):
+    """Angle in radians of the rotation between two unit quaternions."""
+    dot = min(1.0, abs(float(np.dot(q1, q2))))
+    return 2 * math.acos(dot)
+
+class FrameSignature:
+    """Cheap summary of a frame: centroid, bounding box and the set of occupied coarse cells."""
+    __slots__ = ('centroid', 'min_bound', 'max_bound', 'cells')
+
+    def __init__(self, points, cell_size):
+        self.centroid = points.mean(axis=0)
+        self.min_bound = points.min(axis=0)
+        self.max_bound = points.max(axis=0)
+        self.cells = np.unique(pack_voxel_keys(np.floor(points / cell_size)))
+
+    def overlap(self, other):
+        """Jaccard similarity of the occupied cells, 1.0 for identical occupancy."""
+        shared = len(np.intersect1d(self.cells, other.cells, assume_unique=True))
+        return shared / max(len(self.cells) + len(other.cells) - shared, 1)
+
+class KeyframeSelector:
+    """
+    Decide per frame whether it differs enough from the last kept frame to be kept.
+
+    A frame is dropped as redundant only when every check says it is similar to the
+    last keyframe: its centroid moved less than centroid_threshold, no bounding box
+    corner moved more than bbox_threshold, at least min_overlap of its occupied
+    cells (cubes of cell_size) are shared, and, when odometry poses are given, the
+    robot moved less than translation_threshold and turned less than
+    rotation_threshold radians. With max_interval set, a frame is kept at least every
+    max_interval seconds. Empty frames are always dropped.
+    """
+
+    def __init__(self, centroid_threshold=0.05, bbox_threshold=0.1, cell_size=0.2, min_overlap=0.9,
+                 translation_threshold=0.1, rotation_threshold=math.radians(5), max_interval=None):
+        self.centroid_threshold = centroid_threshold
+        self.bbox_threshold = bbox_threshold
+        self.cell_size = cell_size
+        self.min_overlap = min_overlap
+        self.translation_threshold = translation_threshold
+        self.rotation_threshold = rotation_threshold
+        self.max_interval = max_interval
+        self._last_signature = None
+        self._last_pose = None
+        self._last_time = None
+        self.frames_seen = 0
+        self.frames_kept = 0
+        self.points_seen = 0
+        self.points_kept = 0
+
+    def _is_redundant(self, signature, timestamp, pose):
+        last = self._last_signature
+        if last is None:
+            return False
+        if self.max_interval is not None and timestamp is not None and self._last_time is not None:
+            if timestamp - self._last_time >= self.max_interval:
+                return False
+        if pose is not None and self._last_pose is not None:
+            if (np.linalg.norm(pose[0] - self._last_pose[0]) >= self.translation_threshold
+                    or rotation_angle(pose[1], self._last_pose[1]) >= self.rotation_threshold):
+                return False
+        if np.linalg.norm(signature.centroid - last.centroid) >= self.centroid_threshold:
+            return False
+        if max(np.abs(signature.min_bound - last.min_bound).max(),
+               np.abs(signature.max_bound - last.max_bound).max()) >= self.bbox_threshold:
+            return False
+        return signature.overlap(last) >= self.min_overlap
+
+    def is_keyframe(self, points, timestamp=None, pose=None):
+        """Return True if the frame should be kept, and make it the reference if so."""
+        points = np.asarray(points)
+        self.frames_seen += 1
+        self.points_seen += len(points)
+        if len(points) == 0:
+            return False
+        signature = FrameSignature(points, self.cell_size)
+        if self._is_redundant(signature, timestamp, pose):
+            return False
+        self._last_signature = signature
+        self._last_pose = pose
+        self._last_time = timestamp
+        self.frames_kept += 1
+        self.points_kept += len(points)
+        return True
+
+    @property
+    def frames_dropped(self):
+        return self.frames_seen - self.frames_kept
+
+    def summary(self, bytes_per_kept_frame=0.0, write_seconds_per_kept_frame=0.0,
+                aggregation_seconds_per_kept_frame=0.0):
+        """
+        One-line report of the frames dropped. Storage and time saved are estimated from
+        what an average kept frame cost. Write time is reported as such, not as
+        wall-clock time saved, since background writes overlap with decoding.
+        """
+        dropped = self.frames_dropped
+        share = dropped / self.frames_seen if self.frames_seen else 0.0
+        return (f"kept {self.frames_kept} of {self.frames_seen} frames, dropped {dropped} ({share:.0%}), "
+                f"{self.points_seen - self.points_kept} points; saved ~{dropped * bytes_per_kept_frame / 1e6:.1f} MB, "
+                f"~{dropped * write_seconds_per_kept_frame:.1f} s of write-thread time and "
+                f"~{dropped * aggregation_seconds_per_kept_frame:.1f} s of aggregation")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import threading
+
+class LatestFrameBuffer:
+    """
+    Single-slot hand-off between a message callback and a worker thread.
+
+    put() never blocks: a frame that has not been picked up yet is replaced by the
+    newer one and counted as dropped, so a slow consumer always works on the most
+    recent frame instead of falling further behind a growing queue.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            self.received += 1
+            if self._has_item:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait for the next frame. Returns None once the buffer is closed and empty,
+        or when the timeout expires.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._has_item or self._closed, timeout):
+                return None
+            if not self._has_item:
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+    def close(self):
+        """Wake up the consumer; frames already in the slot can still be taken."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import time
+import numpy as np
+
+def replay_bag(bag_file, topic_name, consumer, rate=1.0):
+    """
+    Stand-in publisher: feed a bag's messages to a consumer's submit() with their recorded
+    timing scaled by rate (rate=0 replays as fast as possible).
+    """
+    import rosbag
+
+    with rosbag.Bag(bag_file, "r") as bag:
+        replay_start = first_stamp = None
+        for topic, msg, t in bag.read_messages(topics=[topic_name]):
+            if rate > 0:
+                if first_stamp is None:
+                    replay_start, first_stamp = time.perf_counter(), t.to_sec()
+                delay = (t.to_sec() - first_stamp) / rate - (time.perf_counter() - replay_start)
+                if delay > 0:
+                    time.sleep(delay)
+            consumer.submit(msg)
+
+def replay_synthetic(consumer, num_frames, frequency=10.0, points_per_frame=30000, seed=0):
+    """Stand-in publisher: feed alternating synthetic stair and floor frames at a fixed rate."""
+    from synthetic_pointclouds import make_stair_cloud, make_floor_cloud, make_pointcloud2
+
+    rng = np.random.default_rng(seed)
+    period = 1.0 / frequency if frequency > 0 else 0.0
+    next_publish = time.perf_counter()
+    for index in range(num_frames):
+        make_cloud = make_stair_cloud if index % 2 == 0 else make_floor_cloud
+        msg = make_pointcloud2(make_cloud(points_per_frame, rng=rng), rng=rng)
+        next_publish += period
+        delay = next_publish - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        consumer.submit(msg)
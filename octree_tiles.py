@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+from grand_cloud_aggregation import pack_voxel_keys
+
+INDEX_FILE = 'tiles.json'
+TILES_SUFFIX = '.tiles'
+
+def tile_keys(points, tile_size):
+    """Integer (i, j, k) tile coordinates of each point; tiles are anchored at the origin."""
+    return np.floor(points / tile_size).astype(np.int64)
+
+def tile_name(key):
+    return "_".join(str(int(value)) for value in key)
+
+def lod_order(points, origin, coarsest_cell, levels):
+    """
+    Order a tile's points coarse to fine. Level 0 keeps one point per cell of size
+    coarsest_cell, each following level one point per cell of half the size among the
+    cells still empty, and the last level holds all remaining points. Returns the
+    permutation and the end offset of every level.
+    """
+    remaining = np.arange(len(points))
+    order, ends = [], []
+    taken = np.empty(0, dtype=np.int64)
+    for level in range(levels - 1):
+        cell = coarsest_cell / 2 ** level
+        keys = pack_voxel_keys(np.floor((points[remaining] - origin) / cell))
+        # Cells already holding a point from a coarser level stay as they are
+        occupied = np.isin(keys, pack_voxel_keys(np.floor((points[taken] - origin) / cell)))
+        _, first = np.unique(np.where(occupied, -1, keys), return_index=True)
+        first = first[~occupied[first]]
+        chosen = remaining[first]
+        order.append(chosen)
+        taken = np.concatenate([taken, chosen])
+        keep = np.ones(len(remaining), dtype=bool)
+        keep[first] = False
+        remaining = remaining[keep]
+        ends.append(len(taken))
+    order.append(remaining)
+    ends.append(len(points))
+    return np.concatenate(order), ends
+
+class OctreeTileWriter:
+    """
+    Build a tiled level-of-detail store of an aggregated cloud while frames stream in.
+
+    Space is cut into cubic tiles of tile_size, anchored at the origin so no bounds
+    need to be known in advance. Incoming points are buffered per tile and appended
+    to the tile's spill file whenever flush_points points are buffered, so memory stays
+    bounded however long the recording is. close() finalizes each tile on its own:
+    optionally reduces it to voxel centroids (as GrandCloudAccumulator does, provided
+    tile_size is a multiple of voxel_size), orders its points into octree levels of
+    detail (see lod_order) and writes the index last. A with block left through an
+    exception writes no index.
+    """
+
+    def __init__(self, store_dir, tile_size=2.0, levels=4, voxel_size=None, flush_points=1_000_000,
+                 dtype=np.float32):
+        self.store_dir = os.path.expanduser(store_dir)
+        self.tile_size = tile_size
+        self.levels = levels
+        self.voxel_size = voxel_size
+        self.flush_points = flush_points
+        self.dtype = np.dtype(dtype)
+        # Replace an earlier store (or the leftovers of an interrupted build)
+        if os.path.isdir(self.store_dir) and (os.path.exists(os.path.join(self.store_dir, INDEX_FILE))
+                                              or os.path.isdir(os.path.join(self.store_dir, 'spill'))):
+            shutil.rmtree(self.store_dir)
+        os.makedirs(os.path.join(self.store_dir, 'spill'))
+        self._buffers = {}
+        self._buffered = 0
+        self.num_points_in = 0
+        self._closed = False
+
+    def _spill_path(self, name):
+        return os.path.join(self.store_dir, 'spill', f"{name}.bin")
+
+    def add(self, points):
+        """Add one frame given as an (N, 3) array."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if len(points) == 0:
+            return
+        self.num_points_in += len(points)
+        keys = tile_keys(points, self.tile_size)
+        order = np.lexsort(keys.T[::-1])
+        keys, points = keys[order], points[order]
+        boundaries = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+        for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(points)]))):
+            self._buffers.setdefault(tile_name(keys[start]), []).append(points[start:end])
+        self._buffered += len(points)
+        if self._buffered >= self.flush_points:
+            self._flush()
+
+    def _flush(self):
+        for name, chunks in self._buffers.items():
+            with open(self._spill_path(name), 'ab') as f:
+                np.concatenate(chunks).tofile(f)
+        self._buffers = {}
+        self._buffered = 0
+
+    def _finalize_tile(self, name):
+        points = np.fromfile(self._spill_path(name), dtype=np.float64).reshape(-1, 3)
+        if self.voxel_size:
+            _, inverse = np.unique(pack_voxel_keys(np.floor(points / self.voxel_size)), return_inverse=True)
+            inverse = inverse.ravel()
+            points = (np.column_stack([np.bincount(inverse, weights=points[:, axis]) for axis in range(3)])
+                      / np.bincount(inverse)[:, None])
+        origin = np.array([int(value) for value in name.split('_')]) * self.tile_size
+        order, ends = lod_order(points, origin, self.tile_size / 16, self.levels)
+        tile_path = os.path.join(self.store_dir, f"{name}.bin")
+        points[order].astype(self.dtype).tofile(tile_path)
+        os.remove(self._spill_path(name))
+        return {'count': len(points), 'level_ends': [int(end) for end in ends],
+                'min': points.min(axis=0).tolist(), 'max': points.max(axis=0).tolist()}
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._flush()
+        names = sorted(os.path.splitext(filename)[0] for filename in os.listdir(os.path.join(self.store_dir, 'spill')))
+        tiles = {name: self._finalize_tile(name) for name in names}
+        os.rmdir(os.path.join(self.store_dir, 'spill'))
+        index = {'tile_size': self.tile_size, 'levels': self.levels, 'voxel_size': self.voxel_size,
+                 'dtype': self.dtype.str, 'tiles': tiles}
+        tmp_path = os.path.join(self.store_dir, f".{INDEX_FILE}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.store_dir, INDEX_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the spill directory; the next build of this store removes it
+            self._closed = True
+            self._buffers = {}
+            self._buffered = 0
+
+def _box_arrays(bounds):
+    lower, upper = np.full(3, -np.inf), np.full(3, np.inf)
+    for axis, (min_val, max_val) in (bounds or {}).items():
+        index = 'xyz'.index(axis)
+        lower[index], upper[index] = min_val, max_val
+    return lower, upper
+
+class OctreeTileStore:
+    """
+    Read access to a tile store. query() opens only the tiles whose bounds overlap the
+    requested box, and at a coarse level reads only the first points of each tile file.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = os.path.expanduser(store_dir)
+        with open(os.path.join(self.store_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.tile_size = index['tile_size']
+        self.levels = index['levels']
+        self.voxel_size = index['voxel_size']
+        self.dtype = np.dtype(index['dtype'])
+        self.tiles = index['tiles']
+
+    @property
+    def num_points(self):
+        return sum(tile['count'] for tile in self.tiles.values())
+
+    @property
+    def bounds(self):
+        """Overall (min, max) corners of the stored cloud."""
+        if not self.tiles:
+            return np.zeros(3), np.zeros(3)
+        return (np.min([tile['min'] for tile in self.tiles.values()], axis=0),
+                np.max([tile['max'] for tile in self.tiles.values()], axis=0))
+
+    def tiles_in_box(self, bounds=None):
+        """Names of the tiles overlapping the box given as {'x': (min, max), ...}."""
+        lower, upper = _box_arrays(bounds)
+        return [name for name, tile in self.tiles.items()
+                if np.all(np.asarray(tile['max']) >= lower) and np.all(np.asarray(tile['min']) <= upper)]
+
+    def read_tile(self, name, level=None):
+        """Points of one tile up to a level of detail (all points when level is None)."""
+        tile = self.tiles[name]
+        count = tile['count'] if level is None else tile['level_ends'][min(level, self.levels - 1)]
+        return np.fromfile(os.path.join(self.store_dir, f"{name}.bin"), dtype=self.dtype, count=count * 3).reshape(-1, 3)
+
+    def query(self, bounds=None, level=None):
+        """Points inside the box, from the overlapping tiles only, at the given level of detail."""
+        lower, upper = _box_arrays(bounds)
+        parts = []
+        for name in self.tiles_in_box(bounds):
+            points = self.read_tile(name, level)
+            tile = self.tiles[name]
+            # Tiles entirely inside the box need no per-point test
+            if not (np.all(np.asarray(tile['min']) >= lower) and np.all(np.asarray(tile['max']) <= upper)):
+                points = points[np.all((points >= lower) & (points <= upper), axis=1)]
+            parts.append(points)
+        return np.concatenate(parts) if parts else np.empty((0, 3), dtype=self.dtype)
+
+    def to_point_cloud(self, bounds=None, level=None):
+        import open3d as o3d
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(self.query(bounds, level).astype(np.float64))
+        return pcd
+
+def parse_bounds(specs):
+    """Parse ['x:0:2.5', 'z:-1:0.3'] into {'x': (0.0, 2.5), 'z': (-1.0, 0.3)}."""
+    bounds = {}
+    for spec in specs or []:
+        axis, min_val, max_val = spec.split(':')
+        bounds[axis] = (float(min_val), float(max_val))
+    return bounds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, inspect and query octree tile stores of grand clouds.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Tile an existing grand PCD file")
+    build_parser.add_argument("pcd_file")
+    build_parser.add_argument("store_dir")
+    build_parser.add_argument("--tile-size", type=float, default=2.0)
+    build_parser.add_argument("--levels", type=int, default=4)
+    info_parser = subparsers.add_parser("info", help="Summarize a tile store")
+    info_parser.add_argument("store_dir")
+    query_parser = subparsers.add_parser("query", help="Read the points inside a box")
+    query_parser.add_argument("store_dir")
+    query_parser.add_argument("--bounds", nargs="*", help="Axis bounds such as x:0:2.5 z:-1:0.3")
+    query_parser.add_argument("--level", type=int, help="Level of detail, 0 is the coarsest; all points by default")
+    query_parser.add_argument("--output", help="Write the result to this PCD file")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        import open3d as o3d
+        with OctreeTileWriter(args.store_dir, tile_size=args.tile_size, levels=args.levels) as writer:
+            writer.add(np.asarray(o3d.io.read_point_cloud(args.pcd_file).points))
+    if args.command in ("build", "info"):
+        store = OctreeTileStore(args.store_dir)
+        lower, upper = store.bounds
+        print(f"{len(store.tiles)} tiles of {store.tile_size} m, {store.num_points} points, {store.levels} levels")
+        print(f"bounds {np.round(lower, 2)} to {np.round(upper, 2)}")
+    else:
+        store = OctreeTileStore(args.store_dir)
+        bounds = parse_bounds(args.bounds)
+        print(f"{len(store.tiles_in_box(bounds))} of {len(store.tiles)} tiles overlap the box")
+        if args.output:
+            import open3d as o3d
+            o3d.io.write_point_cloud(args.output, store.to_point_cloud(bounds, args.level))
+        else:
+            print(f"{len(store.query(bounds, args.level))} points")
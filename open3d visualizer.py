@@ -1,29 +1,35 @@
 #!/usr/bin/env python
 
-import rospy
-from sensor_msgs.msg import PointCloud2
-from sensor_msgs import point_cloud2
+import time
+import argparse
+import threading
+from collections import deque
 import numpy as np
 import open3d as o3d
+from pointcloud2_decoder import decode_point_cloud2
+from latest_frame_buffer import LatestFrameBuffer
+from voxel_grid import voxel_downsample
+from message_replay import replay_bag, replay_synthetic
 
 # Callback function to handle incoming PointCloud2 messages
 def callback_pointcloud(msg):
     global points
-    points = []
 
-    # Iterate through all the points in the PointCloud2 message
-    for p in point_cloud2.read_points(msg, field_names=("x", "y", "z"), skip_nans=True):
-        points.append([p[0], p[1], p[2]])
+    # Decode all points of the PointCloud2 message in one vectorized pass
+    points, _ = decode_point_cloud2(msg, extra_fields=())
+
+def show_snapshot(topic_name):
+    """Show the first message of the topic in a blocking window."""
+    import rospy
+    from sensor_msgs.msg import PointCloud2
 
-# Main function
-def main():
     rospy.init_node('pcd_visualizer', anonymous=True)
 
     # Subscriber to the PointCloud2 topic
-    rospy.Subscriber("/scan_3D", PointCloud2, callback_pointcloud)
+    rospy.Subscriber(topic_name, PointCloud2, callback_pointcloud)
 
     # Wait for the first message to arrive
-    rospy.wait_for_message("/scan_3D", PointCloud2)
+    rospy.wait_for_message(topic_name, PointCloud2)
 
     # Convert the points list to numpy array
     points_np = np.array(points)
@@ -37,5 +43,169 @@ def main():
 
     rospy.spin()
 
+class LiveViewer:
+    """
+    Live view of a PointCloud2 stream.
+
+    submit() hands messages to a decode thread through a LatestFrameBuffer, so a
+    subscriber callback never waits. The decode thread decodes, decimates (every
+    decimation-th point) or voxel-downsamples for preview, and passes the result to
+    the render loop through a second single-slot buffer. The render loop runs on the
+    calling thread, reuses one PointCloud geometry and updates it in place in a
+    non-blocking Visualizer. Frames that arrive faster than they can be decoded or
+    drawn are dropped and counted. With headless set, no window is opened and the
+    loop only updates the geometry, which lets the viewer run on replayed or synthetic
+    messages without a display.
+    """
+
+    def __init__(self, decimation=1, voxel_size=None, headless=False, report_interval=2.0, log=print):
+        self.decimation = max(1, decimation)
+        self.voxel_size = voxel_size
+        self.headless = headless
+        self.report_interval = report_interval
+        self.log = log
+        self.messages = LatestFrameBuffer()
+        self.frames = LatestFrameBuffer()
+        self.pcd = o3d.geometry.PointCloud()
+        self.decoded = 0
+        self.rendered = 0
+        self.errors = 0
+        self._render_times = deque(maxlen=120)
+        self._decoder = threading.Thread(target=self._decode, daemon=True)
+
+    def start(self):
+        self._decoder.start()
+        return self
+
+    def submit(self, msg):
+        self.messages.put(msg)
+
+    def close(self):
+        """Signal the end of the stream; frames already received are still shown."""
+        self.messages.close()
+
+    def preview_points(self, msg):
+        points, _ = decode_point_cloud2(msg, extra_fields=())
+        if self.voxel_size and len(points):
+            return voxel_downsample(points, self.voxel_size)
+        return points[::self.decimation]
+
+    def _decode(self):
+        try:
+            while True:
+                msg = self.messages.get()
+                if msg is None:
+                    if self.messages.closed:
+                        break
+                    continue
+                try:
+                    self.frames.put(self.preview_points(msg))
+                    self.decoded += 1
+                except Exception as e:
+                    self.errors += 1
+                    self.log(f"Failed to decode frame: {e}")
+        finally:
+            self.frames.close()
+
+    @property
+    def fps(self):
+        if len(self._render_times) < 2:
+            return 0.0
+        return (len(self._render_times) - 1) / max(self._render_times[-1] - self._render_times[0], 1e-9)
+
+    def report(self):
+        dropped = self.messages.dropped + self.frames.dropped
+        return (f"{self.fps:.1f} FPS, {self.rendered} rendered, {self.decoded} decoded of "
+                f"{self.messages.received} received, {dropped} dropped "
+                f"({self.messages.dropped} before decoding, {self.frames.dropped} before drawing)")
+
+    def run(self, should_stop=lambda: False, poll_interval=1 / 60):
+        """
+        Draw frames until the stream ends (headless), the window is closed or
+        should_stop() returns True.
+        """
+        visualizer = None
+        if not self.headless:
+            visualizer = o3d.visualization.Visualizer()
+            visualizer.create_window(window_name="Live point cloud")
+            visualizer.add_geometry(self.pcd)
+        last_report = time.perf_counter()
+        try:
+            while not should_stop():
+                points = self.frames.get(timeout=poll_interval)
+                if points is None and self.frames.closed and self.headless:
+                    # The last frame may have been put between the timed-out get() and close()
+                    points = self.frames.get(timeout=0)
+                    if points is None:
+                        break
+                if points is not None:
+                    self.pcd.points = o3d.utility.Vector3dVector(points)
+                    if visualizer is not None:
+                        visualizer.update_geometry(self.pcd)
+                        if self.rendered == 0:
+                            # Fit the camera to the first frame only
+                            visualizer.reset_view_point(True)
+                    self.rendered += 1
+                    self._render_times.append(time.perf_counter())
+                if visualizer is not None:
+                    if not visualizer.poll_events():
+                        break
+                    visualizer.update_renderer()
+                if self.report_interval and time.perf_counter() - last_report >= self.report_interval:
+                    self.log(self.report())
+                    last_report = time.perf_counter()
+        finally:
+            if visualizer is not None:
+                visualizer.destroy_window()
+            self.close()
+
+def run_live(viewer, topic_name=None, bag_file=None, synthetic=0, rate=1.0, frequency=10.0):
+    """
+    Feed the viewer from a bag replay, synthetic frames or the live topic, and run
+    its render loop on this thread.
+    """
+    viewer.start()
+    if bag_file or synthetic:
+        def publish():
+            try:
+                if bag_file:
+                    replay_bag(bag_file, topic_name, viewer, rate=rate)
+                else:
+                    replay_synthetic(viewer, synthetic, frequency=frequency)
+            finally:
+                viewer.close()
+        threading.Thread(target=publish, daemon=True).start()
+        viewer.run()
+    else:
+        import rospy
+        from sensor_msgs.msg import PointCloud2
+
+        rospy.init_node('pcd_visualizer', anonymous=True)
+        # queue_size=1 lets rospy discard stale messages before they reach the callback
+        rospy.Subscriber(topic_name, PointCloud2, viewer.submit, queue_size=1, buff_size=2 ** 24)
+        viewer.run(should_stop=rospy.is_shutdown)
+    viewer.log(viewer.report())
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser(description="Visualize PointCloud2 messages.")
+    parser.add_argument("--topic", default="/scan_3D")
+    parser.add_argument("--live", action="store_true", help="Keep updating the view instead of showing one snapshot")
+    parser.add_argument("--decimation", type=int, default=1, help="Draw every n-th point")
+    parser.add_argument("--voxel-size", type=float, help="Draw a voxel-downsampled preview instead")
+    parser.add_argument("--headless", action="store_true", help="Process frames without opening a window")
+    parser.add_argument("--bag", help="Replay this bag instead of subscribing to the topic")
+    parser.add_argument("--synthetic", type=int, default=0, help="Replay this many synthetic frames instead")
+    parser.add_argument("--rate", type=float, default=1.0, help="Bag replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--frequency", type=float, default=10.0, help="Synthetic frame rate in Hz")
+    args = parser.parse_args()
+
+    if not (args.live or args.headless or args.bag or args.synthetic):
+        show_snapshot(args.topic)
+        return
+    viewer = LiveViewer(decimation=args.decimation, voxel_size=args.voxel_size, headless=args.headless)
+    run_live(viewer, args.topic, bag_file=args.bag, synthetic=args.synthetic, rate=args.rate,
+             frequency=args.frequency)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# Bumped whenever the feature definitions change, so cached feature rows are rebuilt
+FEATURE_VERSION = 2
+
+FEATURE_COLUMNS = [
+    'eigenvalue_1', 'eigenvalue_2', 'eigenvalue_3',
+    'eigenvector_1_x', 'eigenvector_1_y', 'eigenvector_1_z',
+    'eigenvector_2_x', 'eigenvector_2_y', 'eigenvector_2_z',
+    'linearity', 'planarity', 'sphericity', 'normal_angle',
+]
+
+# Upper-triangle entries of a 3x3 symmetric matrix
+_TRIU = [(0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)]
+
+def grouped_scatter_matrices(points, group_ids, num_groups):
+    """
+    Compute the scatter matrix sum((p - mean)(p - mean)^T) of every group of points.
+    Points are centred on their group mean before the products are accumulated,
+    which avoids the cancellation of the sum(p p^T) - n mean mean^T form.
+    Returns (num_groups, 3, 3) matrices and the (num_groups,) point counts.
+    """
+    counts = np.bincount(group_ids, minlength=num_groups)
+    means = np.column_stack([np.bincount(group_ids, weights=points[:, axis], minlength=num_groups)
+                             for axis in range(3)])
+    means /= np.maximum(counts, 1)[:, None]
+    centred = points - means[group_ids]
+
+    scatter = np.empty((num_groups, 3, 3))
+    for i, j in _TRIU:
+        scatter[:, i, j] = np.bincount(group_ids, weights=centred[:, i] * centred[:, j], minlength=num_groups)
+        scatter[:, j, i] = scatter[:, i, j]
+    return scatter, counts
+
+def scatter_matrices(point_sets):
+    """Scatter matrices of a list of (N_i, 3) arrays, computed in one batched pass."""
+    sizes = np.array([len(points) for points in point_sets])
+    if len(point_sets) == 0:
+        return np.empty((0, 3, 3)), sizes
+    points = np.concatenate([np.asarray(points, dtype=np.float64).reshape(-1, 3) for points in point_sets])
+    group_ids = np.repeat(np.arange(len(point_sets)), sizes)
+    return grouped_scatter_matrices(points, group_ids, len(point_sets))
+
+def canonical_eigh(matrices):
+    """
+    Eigen-decompose a batch of symmetric 3x3 matrices with eigh.
+    Eigenvalues are returned in descending order and each eigenvector is flipped
+    so that its largest-magnitude component is positive, making signs reproducible.
+    """
+    eigen_values, eigen_vectors = np.linalg.eigh(matrices)
+    eigen_values = eigen_values[:, ::-1]
+    eigen_vectors = eigen_vectors[:, :, ::-1]
+    # Symmetric PSD matrices can give tiny negative eigenvalues from rounding
+    eigen_values = np.maximum(eigen_values, 0.0)
+
+    batch = np.arange(len(matrices))[:, None]
+    dominant = np.abs(eigen_vectors).argmax(axis=1)
+    signs = np.sign(eigen_vectors[batch, dominant, np.arange(3)])
+    signs[signs == 0] = 1.0
+    return eigen_values, eigen_vectors * signs[:, None, :]
+
+def eigen_descriptors(eigen_values, eigen_vectors):
+    """
+    Standard eigenvalue shape descriptors for each matrix in the batch:
+    linearity (l1 - l2) / l1, planarity (l2 - l3) / l1, sphericity l3 / l1, and the
+    angle in degrees between the surface normal (smallest eigenvector) and the z axis.
+    """
+    l1, l2, l3 = eigen_values[:, 0], eigen_values[:, 1], eigen_values[:, 2]
+    safe_l1 = np.where(l1 > 0, l1, 1.0)
+    valid = l1 > 0
+    normal_z = np.clip(np.abs(eigen_vectors[:, 2, 2]), 0.0, 1.0)
+    return {
+        'linearity': np.where(valid, (l1 - l2) / safe_l1, 0.0),
+        'planarity': np.where(valid, (l2 - l3) / safe_l1, 0.0),
+        'sphericity': np.where(valid, l3 / safe_l1, 0.0),
+        'normal_angle': np.degrees(np.arccos(normal_z)),
+    }
+
+def features_from_scatter(scatter):
+    """Turn a batch of scatter matrices into the FEATURE_COLUMNS arrays."""
+    eigen_values, eigen_vectors = canonical_eigh(scatter)
+    features = {
+        'eigenvalue_1': eigen_values[:, 0],
+        'eigenvalue_2': eigen_values[:, 1],
+        'eigenvalue_3': eigen_values[:, 2],
+    }
+    for vector in range(2):
+        for axis, axis_name in enumerate('xyz'):
+            features[f'eigenvector_{vector + 1}_{axis_name}'] = eigen_vectors[:, axis, vector]
+    features.update(eigen_descriptors(eigen_values, eigen_vectors))
+    return features
+
+def compute_features(point_sets):
+    """
+    Compute PCA features for a batch of point clouds given as (N_i, 3) arrays.
+    Returns a dict mapping each name in FEATURE_COLUMNS to a (len(point_sets),) array.
+    """
+    scatter, _ = scatter_matrices(point_sets)
+    return features_from_scatter(scatter)
+
+def compute_region_features(points, region_size, min_points=10):
+    """
+    Sharded mode for large clouds: split the cloud into square xy regions of side
+    region_size and compute PCA features for every region holding at least min_points.
+    Returns the (M, 2) integer region indices, the (M,) point counts and the feature dict.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        return np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64), features_from_scatter(np.empty((0, 3, 3)))
+    regions = np.floor(points[:, :2] / region_size).astype(np.int64)
+    # Group on one packed integer key, which is much cheaper than np.unique over rows
+    origin = regions.min(axis=0)
+    regions -= origin
+    num_rows = regions[:, 1].max() + 1
+    region_keys, group_ids = np.unique(regions[:, 0] * num_rows + regions[:, 1], return_inverse=True)
+    group_ids = group_ids.reshape(-1)
+    region_index = np.column_stack((region_keys // num_rows, region_keys % num_rows)) + origin
+    scatter, counts = grouped_scatter_matrices(points, group_ids, len(region_keys))
+    keep = counts >= min_points
+    features = features_from_scatter(scatter[keep])
+    return region_index[keep], counts[keep], features
@@ -2,20 +2,21 @@
 
 import os
 import numpy as np
-import open3d as o3d
 import pandas as pd
 import glob
+import argparse
+from stage_cache import StageCache
+from pca_feature_engine import FEATURE_COLUMNS, FEATURE_VERSION, compute_features, scatter_matrices, canonical_eigh
+from feature_store import write_feature_partition
+from frame_store import FrameStore, is_frame_store
+from async_writer import AsyncWriter
+from pipeline_metrics import metrics, read_point_cloud, profiled, add_metrics_arguments, configure_metrics
 
 def apply_pca_to_point_cloud(pcd):
     """Apply PCA to a point cloud and return the eigen vectors and values."""
-    points = np.asarray(pcd.points)
-    mean_centered = points - np.mean(points, axis=0)
-    H = np.dot(mean_centered.T, mean_centered)
-    eigen_values, eigen_vectors = np.linalg.eig(H)
-    idx = eigen_values.argsort()[::-1]
-    eigen_values = eigen_values[idx]
-    eigen_vectors = eigen_vectors[:, idx]
-    return eigen_values, eigen_vectors
+    scatter, _ = scatter_matrices([np.asarray(pcd.points)])
+    eigen_values, eigen_vectors = canonical_eigh(scatter)
+    return eigen_values[0], eigen_vectors[0]
 
 def determine_label(directory_name):
     """Determine the label of the PCD file based on its directory name."""
@@ -25,40 +26,103 @@ def determine_label(directory_name):
     else:
         return 0
 
-def process_pcd_files(base_directory):
+def feature_rows(features, labels):
+    """Convert batched feature arrays into one dict per cloud, with the label first."""
+    return [dict({'label': label}, **{name: float(features[name][i]) for name in FEATURE_COLUMNS})
+            for i, label in enumerate(labels)]
+
+def extract_pca_features(pcd, label):
+    """Compute the PCA feature row of one point cloud."""
+    return feature_rows(compute_features([np.asarray(pcd.points)]), [label])[0]
+
+def frame_store_features(store_path, batch_size=256):
+    """
+    PCA feature rows of every frame of a frame store, read straight from the memory-mapped
+    points. Frames without a stored label are labelled by the store's bag name.
+    """
+    store = FrameStore(store_path)
+    default_label = determine_label(store.name)
+    labels = [int(label) if label >= 0 else default_label for label in store.labels]
+    rows = []
+    for start in range(0, len(store), batch_size):
+        point_sets = [store.frame(index) for index in range(start, min(start + batch_size, len(store)))]
+        with metrics.stage('pca_features', points_in=sum(len(points) for points in point_sets)):
+            rows.extend(feature_rows(compute_features(point_sets), labels[start:start + batch_size]))
+    return rows
+
+def process_pcd_files(base_directory, cache=None, batch_size=256, store_dir=None):
+    """
+    Compute the PCA feature rows of every PCD file one directory below base_directory,
+    and of every frame of the frame stores (see frame_store.py) found there.
+    With store_dir set, each directory's rows are also written as one partition of a
+    columnar feature store (see feature_store.py).
+    """
     pca_results = []
-    
-    # Iterate over each directory within the base directory
-    for directory in glob.glob(os.path.join(base_directory, '*')):
-        if os.path.isdir(directory):
-            label = determine_label(os.path.basename(directory))
-            # Process each PCD file in the directory
-            for pcd_file in glob.glob(os.path.join(directory, '*.pcd')):
-                pcd = o3d.io.read_point_cloud(pcd_file)
-                eigen_values, eigen_vectors = apply_pca_to_point_cloud(pcd)
-                pca_results.append({
-                    'label': label,
-                    'eigenvalue_1': eigen_values[0],
-                    'eigenvalue_2': eigen_values[1],
-                    'eigenvalue_3': eigen_values[2],
-                    'eigenvector_1_x': eigen_vectors[0, 0],
-                    'eigenvector_1_y': eigen_vectors[1, 0],
-                    'eigenvector_1_z': eigen_vectors[2, 0],
-                    'eigenvector_2_x': eigen_vectors[0, 1],
-                    'eigenvector_2_y': eigen_vectors[1, 1],
-                    'eigenvector_2_z': eigen_vectors[2, 1],
-                })
+    # Feature partitions are written in the background while the next directory is processed
+    with AsyncWriter() as writer:
+        # Iterate over each directory within the base directory
+        for directory in glob.glob(os.path.join(base_directory, '*')):
+            if is_frame_store(directory):
+                store = FrameStore(directory)
+                params = {'feature_version': FEATURE_VERSION}
+                entry = cache.lookup('pca_features', store.index_path, params) if cache is not None else None
+                if entry is not None:
+                    directory_results = entry['result']
+                else:
+                    directory_results = frame_store_features(directory, batch_size)
+                    if cache is not None:
+                        cache.record('pca_features', store.index_path, params, result=directory_results)
+                pca_results.extend(directory_results)
+                if store_dir and directory_results:
+                    writer.submit(write_feature_partition, directory_results, store_dir, store.name, mode='overwrite')
+            elif os.path.isdir(directory):
+                label = determine_label(os.path.basename(directory))
+                params = {'label': label, 'feature_version': FEATURE_VERSION}
+                directory_results = []
+                pending = []
+                for pcd_file in glob.glob(os.path.join(directory, '*.pcd')):
+                    entry = cache.lookup('pca_features', pcd_file, params) if cache is not None else None
+                    if entry is not None:
+                        directory_results.append(entry['result'])
+                    else:
+                        pending.append(pcd_file)
+
+                # Compute features for the remaining files in batches
+                for start in range(0, len(pending), batch_size):
+                    batch_files = pending[start:start + batch_size]
+                    point_sets = [np.asarray(read_point_cloud(pcd_file).points) for pcd_file in batch_files]
+                    with metrics.stage('pca_features', points_in=sum(len(points) for points in point_sets)):
+                        rows = feature_rows(compute_features(point_sets), [label] * len(batch_files))
+                    directory_results.extend(rows)
+                    if cache is not None:
+                        for pcd_file, row in zip(batch_files, rows):
+                            cache.record('pca_features', pcd_file, params, result=row)
+
+                pca_results.extend(directory_results)
+                if store_dir and directory_results:
+                    writer.submit(write_feature_partition, directory_results, store_dir, os.path.basename(directory),
+                                  mode='overwrite')
+    if cache is not None:
+        cache.save()
+        metrics.log(cache.summary())
     return pca_results
 
 def save_pca_results(results, output_file):
     """Save PCA results to a CSV file."""
     df = pd.DataFrame(results)
     df.to_csv(output_file, index=False)
-    print(f"Saved PCA results to {output_file}")
+    metrics.log(f"Saved PCA results to {output_file}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
     base_directory = '~/SYDE675_project/syde_675_data/pcd_passthrough_filtered_x'
     output_file = '~/SYDE675_project/syde_675_data/pcd_passthrough_filtered_x/pca_features_with_labels.csv'
+    # Columnar copy of the features, one partition per bag directory
+    feature_store_dir = '~/SYDE675_project/syde_675_data/pcd_passthrough_filtered_x/pca_features_store'
 
     # For test dataset
     # base_directory = '~/SYDE675_project/syde_675_data/test_dataset/processed_pointclouds_combined'
@@ -67,6 +131,11 @@ if __name__ == "__main__":
     # Ensure the path is absolute
     base_directory = os.path.expanduser(base_directory)
     output_file = os.path.expanduser(output_file)
+    feature_store_dir = os.path.expanduser(feature_store_dir)
     
-    pca_results = process_pcd_files(base_directory)
-    save_pca_results(pca_results, output_file)
\ No newline at end of file
+    # Feature rows of unchanged PCD files are reused from the stage cache
+    cache = StageCache(os.path.join(base_directory, 'stage_cache_pca.json'))
+    with profiled(args.profile):
+        pca_results = process_pcd_files(base_directory, cache=cache, store_dir=feature_store_dir)
+        save_pca_results(pca_results, output_file)
+    metrics.report(args.metrics)
\ No newline at end of file
@@ -1,36 +1,165 @@
 import os
 import open3d as o3d
 import glob
+import numpy as np
+import argparse
+from pipeline_metrics import metrics, read_point_cloud, profiled, add_metrics_arguments, configure_metrics
+from stage_cache import StageCache
+from async_writer import AsyncWriter
+from frame_store import INDEX_FILE, store_files, take_frame_stores, transform_frame_store
+from voxel_grid import VOXEL_MODES, voxel_downsample_batch, voxel_downsample_to_target
 
 def apply_voxel_downsampling(pcd, voxel_size):
-    print(f"Applying voxel grid downsampling with voxel size: {voxel_size}")
+    metrics.log(f"Applying voxel grid downsampling with voxel size: {voxel_size}")
     downsampled_pcd = pcd.voxel_down_sample(voxel_size=voxel_size)
     return downsampled_pcd
 
-def process_directory(input_dir, output_dir, voxel_size):
+def downsample_points(points, voxel_size):
+    """Voxel downsampling of an (N, 3) array, returned in the array's dtype."""
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(np.asarray(points, dtype=np.float64))
+    return np.asarray(pcd.voxel_down_sample(voxel_size=voxel_size).points).astype(points.dtype)
+
+def process_directory(input_dir, output_dir, voxel_size, cache=None, write_workers=2):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        print(f"Created output directory: {output_dir}")
-    print(f"Starting processing of directory: {input_dir}")
+        metrics.log(f"Created output directory: {output_dir}")
+    metrics.log(f"Starting processing of directory: {input_dir}")
+    # Outputs are written on background threads while the next files are processed
+    writer = AsyncWriter(workers=write_workers)
     for subdir, dirs, files in os.walk(input_dir):
+        # Frame stores are downsampled frame by frame into a store of the same name
+        for input_store in take_frame_stores(subdir, dirs):
+            output_store = os.path.join(output_dir, os.path.relpath(input_store, input_dir))
+            params = {'voxel_size': voxel_size}
+            store_index = os.path.join(input_store, INDEX_FILE)
+            if cache is not None and cache.lookup('voxel_downsampling', store_index, params):
+                continue
+            metrics.log(f"Processing frame store: {input_store}")
+            with metrics.stage('voxel_downsampling') as record:
+                record.points_in, record.points_out = transform_frame_store(
+                    input_store, output_store, lambda points: downsample_points(points, voxel_size))
+            metrics.log(f"Saved downsampled frame store to: {output_store}")
+            if cache is not None:
+                cache.record('voxel_downsampling', store_index, params, outputs=store_files(output_store))
         for filename in files:
-            if filename.endswith('.pcd'):
+            # Dot-files are temporary files of writes still in progress
+            if filename.endswith('.pcd') and not filename.startswith('.'):
                 file_path = os.path.join(subdir, filename)
-                print(f"Processing file: {file_path}")
-                pcd = o3d.io.read_point_cloud(file_path)
-                downsampled_pcd = apply_voxel_downsampling(pcd, voxel_size)
+                params = {'voxel_size': voxel_size}
+                if cache is not None and cache.lookup('voxel_downsampling', file_path, params):
+                    continue
+                metrics.log(f"Processing file: {file_path}")
+                pcd = read_point_cloud(file_path)
+                with metrics.stage('voxel_downsampling', points_in=len(pcd.points)) as record:
+                    downsampled_pcd = apply_voxel_downsampling(pcd, voxel_size)
+                    record.points_out = len(downsampled_pcd.points)
                 relative_path = os.path.relpath(subdir, input_dir)
                 output_subdir = os.path.join(output_dir, relative_path)
                 if not os.path.exists(output_subdir):
                     os.makedirs(output_subdir)
-                    print(f"Created subdirectory for output: {output_subdir}")
+                    metrics.log(f"Created subdirectory for output: {output_subdir}")
                 output_path = os.path.join(output_subdir, filename)
-                o3d.io.write_point_cloud(output_path, downsampled_pcd)
-                print(f"Saved downsampled PCD to: {output_path}")
-    print("Finished processing all files.")
-
-# Example usage
-input_dir = '/home/jetson/SYDE675_project/syde_675_data/processed_pointclouds_combined'
-output_dir = '/home/jetson/SYDE675_project/syde_675_data/pcd_voxel_downsampled'
-voxel_size = 0.05  # Adjust voxel size as needed
-process_directory(input_dir, output_dir, voxel_size)
+                writer.write_point_cloud(output_path, downsampled_pcd)
+                metrics.log(f"Queued downsampled PCD for writing to: {output_path}")
+                if cache is not None:
+                    cache.record('voxel_downsampling', file_path, params, outputs=[output_path])
+    # Entries are only saved once every queued write has succeeded
+    writer.close()
+    if cache is not None:
+        cache.save()
+        metrics.log(cache.summary())
+    metrics.log("Finished processing all files.")
+
+def downsample_batch(point_sets, voxel_size=None, target_points=None, mode='centroid'):
+    """
+    Downsample a batch of (N, 3) arrays with the NumPy voxel grid (see voxel_grid.py),
+    either with a fixed voxel size or to about target_points points per frame.
+    """
+    if target_points:
+        downsampled, _ = voxel_downsample_to_target(point_sets, target_points, mode)
+    else:
+        downsampled = voxel_downsample_batch(point_sets, voxel_size, mode)
+    return [points.astype(original.dtype) for points, original in zip(downsampled, point_sets)]
+
+def process_directory_batched(input_dir, output_dir, voxel_size=None, target_points=None, mode='centroid',
+                              batch_size=64, cache=None, write_workers=2):
+    """
+    Like process_directory, but downsample the files of each directory (and the frames
+    of each frame store) in batches with the vectorized voxel grid. With target_points
+    set, each frame gets its own voxel size chosen to leave about that many points.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    params = {'voxel_size': voxel_size, 'target_points': target_points, 'mode': mode}
+    metrics.log(f"Starting batched processing of directory: {input_dir}")
+    writer = AsyncWriter(workers=write_workers)
+    for subdir, dirs, files in os.walk(input_dir):
+        for input_store in take_frame_stores(subdir, dirs):
+            output_store = os.path.join(output_dir, os.path.relpath(input_store, input_dir))
+            store_index = os.path.join(input_store, INDEX_FILE)
+            if cache is not None and cache.lookup('voxel_downsampling', store_index, params):
+                continue
+            metrics.log(f"Processing frame store: {input_store}")
+            with metrics.stage('voxel_downsampling') as record:
+                record.points_in, record.points_out = transform_frame_store(
+                    input_store, output_store,
+                    lambda frames: downsample_batch(frames, voxel_size, target_points, mode), batch_size=batch_size)
+            if cache is not None:
+                cache.record('voxel_downsampling', store_index, params, outputs=store_files(output_store))
+
+        pending = []
+        for filename in sorted(files):
+            file_path = os.path.join(subdir, filename)
+            if not filename.endswith('.pcd') or filename.startswith('.'):
+                continue
+            if cache is None or not cache.lookup('voxel_downsampling', file_path, params):
+                pending.append(file_path)
+        if not pending:
+            continue
+        output_subdir = os.path.join(output_dir, os.path.relpath(subdir, input_dir))
+        os.makedirs(output_subdir, exist_ok=True)
+        for start in range(0, len(pending), batch_size):
+            batch_files = pending[start:start + batch_size]
+            point_sets = [np.asarray(read_point_cloud(file_path).points) for file_path in batch_files]
+            with metrics.stage('voxel_downsampling', points_in=sum(len(points) for points in point_sets)) as record:
+                downsampled = downsample_batch(point_sets, voxel_size, target_points, mode)
+                record.points_out = sum(len(points) for points in downsampled)
+            for file_path, points in zip(batch_files, downsampled):
+                pcd = o3d.geometry.PointCloud()
+                pcd.points = o3d.utility.Vector3dVector(points)
+                output_path = os.path.join(output_subdir, os.path.basename(file_path))
+                writer.write_point_cloud(output_path, pcd)
+                metrics.log(f"Queued downsampled PCD for writing to: {output_path}")
+                if cache is not None:
+                    cache.record('voxel_downsampling', file_path, params, outputs=[output_path])
+    # Entries are only saved once every queued write has succeeded
+    writer.close()
+    if cache is not None:
+        cache.save()
+        metrics.log(cache.summary())
+    metrics.log("Finished processing all files.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batched", action="store_true",
+                        help="Use the vectorized NumPy voxel grid on batches of files instead of Open3D per file")
+    parser.add_argument("--target-points", type=int, help="Choose each frame's voxel size to keep about this many points")
+    parser.add_argument("--mode", choices=VOXEL_MODES, default="centroid", help="Point kept per voxel in batched mode")
+    parser.add_argument("--batch-size", type=int, default=64)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
+    # Example usage
+    input_dir = '/home/jetson/SYDE675_project/syde_675_data/processed_pointclouds_combined'
+    output_dir = '/home/jetson/SYDE675_project/syde_675_data/pcd_voxel_downsampled'
+    voxel_size = 0.05  # Adjust voxel size as needed
+    # Skip files already downsampled with the same voxel size
+    cache = StageCache(os.path.join(output_dir, 'stage_cache.json'))
+    with profiled(args.profile):
+        if args.batched or args.target_points:
+            process_directory_batched(input_dir, output_dir, voxel_size, args.target_points, args.mode,
+                                      args.batch_size, cache=cache)
+        else:
+            process_directory(input_dir, output_dir, voxel_size, cache=cache)
+    metrics.report(args.metrics)
@@ -1,49 +1,75 @@
 import os
-import open3d as o3d
-import numpy as np
 import glob
+import argparse
+from pipeline_metrics import metrics, read_point_cloud, profiled, add_metrics_arguments, configure_metrics
+from pcd_filter_passthrough import apply_passthrough_filter, crop_box_mask
+from stage_cache import StageCache
+from async_writer import AsyncWriter
+from frame_store import INDEX_FILE, store_files, take_frame_stores, transform_frame_store
 
-def apply_passthrough_filter(pcd, axis, min_val, max_val):
-    print(f"Applying pass-through filter on axis {axis} with bounds ({min_val}, {max_val})")
-    points = np.asarray(pcd.points)
-    if axis == 'x':
-        mask = np.logical_and(points[:, 0] >= min_val, points[:, 0] <= max_val)
-    elif axis == 'y':
-        mask = np.logical_and(points[:, 1] >= min_val, points[:, 1] <= max_val)
-    elif axis == 'z':
-        mask = np.logical_and(points[:, 2] >= min_val, points[:, 2] <= max_val)
-    else:
-        raise ValueError("Axis must be 'x', 'y', or 'z'")
-    filtered_points = points[mask]
-    filtered_pcd = o3d.geometry.PointCloud()
-    filtered_pcd.points = o3d.utility.Vector3dVector(filtered_points)
-    return filtered_pcd
-
-def process_directory(input_dir, output_dir, x_bounds):
+def process_directory(input_dir, output_dir, x_bounds, cache=None, write_workers=2):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        print(f"Created output directory: {output_dir}")
-    print(f"Starting processing of directory: {input_dir}")
+        metrics.log(f"Created output directory: {output_dir}")
+    metrics.log(f"Starting processing of directory: {input_dir}")
+    # Outputs are written on background threads while the next files are processed
+    writer = AsyncWriter(workers=write_workers)
     for subdir, dirs, files in os.walk(input_dir):
+        # Frame stores are filtered frame by frame into a store of the same name
+        for input_store in take_frame_stores(subdir, dirs):
+            output_store = os.path.join(output_dir, os.path.relpath(input_store, input_dir))
+            params = {'x_bounds': list(x_bounds)}
+            store_index = os.path.join(input_store, INDEX_FILE)
+            if cache is not None and cache.lookup('passthrough_x', store_index, params):
+                continue
+            metrics.log(f"Processing frame store: {input_store}")
+            with metrics.stage('crop_box_filter') as record:
+                record.points_in, record.points_out = transform_frame_store(
+                    input_store, output_store, lambda points: points[crop_box_mask(points, {'x': x_bounds})])
+            metrics.log(f"Saved filtered frame store to: {output_store}")
+            if cache is not None:
+                cache.record('passthrough_x', store_index, params, outputs=store_files(output_store))
         for filename in files:
-            if filename.endswith('.pcd'):
+            # Dot-files are temporary files of writes still in progress
+            if filename.endswith('.pcd') and not filename.startswith('.'):
                 file_path = os.path.join(subdir, filename)
-                print(f"Processing file: {file_path}")
-                pcd = o3d.io.read_point_cloud(file_path)
+                params = {'x_bounds': list(x_bounds)}
+                if cache is not None and cache.lookup('passthrough_x', file_path, params):
+                    continue
+                metrics.log(f"Processing file: {file_path}")
+                pcd = read_point_cloud(file_path)
                 # Apply pass-through filter on x axis
-                pcd = apply_passthrough_filter(pcd, 'x', *x_bounds)
+                with metrics.stage('crop_box_filter', points_in=len(pcd.points)) as record:
+                    pcd = apply_passthrough_filter(pcd, 'x', *x_bounds)
+                    record.points_out = len(pcd.points)
                 relative_path = os.path.relpath(subdir, input_dir)
                 output_subdir = os.path.join(output_dir, relative_path)
                 if not os.path.exists(output_subdir):
                     os.makedirs(output_subdir)
-                    print(f"Created subdirectory for output: {output_subdir}")
+                    metrics.log(f"Created subdirectory for output: {output_subdir}")
                 output_path = os.path.join(output_subdir, filename)
-                o3d.io.write_point_cloud(output_path, pcd)
-                print(f"Saved filtered PCD to: {output_path}")
-    print("Finished processing all files.")
+                writer.write_point_cloud(output_path, pcd)
+                metrics.log(f"Queued filtered PCD for writing to: {output_path}")
+                if cache is not None:
+                    cache.record('passthrough_x', file_path, params, outputs=[output_path])
+    # Entries are only saved once every queued write has succeeded
+    writer.close()
+    if cache is not None:
+        cache.save()
+        metrics.log(cache.summary())
+    metrics.log("Finished processing all files.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
 
-# Example usage
-input_dir = '/home/jetson/SYDE675_project/syde_675_data/processed_pointclouds_combined'
-output_dir = '/home/jetson/SYDE675_project/syde_675_data/pcd_passthrough_filtered_x'
-x_bounds = (0.0, 2.5) 
-process_directory(input_dir, output_dir, x_bounds)
+    # Example usage
+    input_dir = '/home/jetson/SYDE675_project/syde_675_data/processed_pointclouds_combined'
+    output_dir = '/home/jetson/SYDE675_project/syde_675_data/pcd_passthrough_filtered_x'
+    x_bounds = (0.0, 2.5)
+    cache = StageCache(os.path.join(output_dir, 'stage_cache.json'))
+    with profiled(args.profile):
+        process_directory(input_dir, output_dir, x_bounds, cache=cache)
+    metrics.report(args.metrics)
@@ -2,44 +2,125 @@ import os
 import open3d as o3d
 import numpy as np
 import glob
+import argparse
+from pipeline_metrics import metrics, read_point_cloud, profiled, add_metrics_arguments, configure_metrics
+from stage_cache import StageCache
+from async_writer import AsyncWriter
+from frame_store import INDEX_FILE, store_files, take_frame_stores, transform_frame_store
+
+AXIS_INDEX = {'x': 0, 'y': 1, 'z': 2}
+
+def crop_box_mask(points, bounds):
+    """
+    Compute one boolean mask selecting the points inside every given axis bound.
+    bounds maps axis names to (min_val, max_val); unlisted axes are unbounded.
+    """
+    lower = np.full(3, -np.inf)
+    upper = np.full(3, np.inf)
+    for axis, (min_val, max_val) in bounds.items():
+        if axis not in AXIS_INDEX:
+            raise ValueError("Axis must be 'x', 'y', or 'z'")
+        lower[AXIS_INDEX[axis]] = min_val
+        upper[AXIS_INDEX[axis]] = max_val
+    return np.all((points >= lower) & (points <= upper), axis=1)
+
+def apply_crop_box_filter(pcd, bounds):
+    """
+    Keep the points of pcd that fall inside all axis bounds, in a single pass.
+    Colors and normals are kept by the legacy PointCloud; tensor point clouds
+    (o3d.t.geometry.PointCloud) keep every attribute, including intensity.
+    """
+    if isinstance(pcd, o3d.t.geometry.PointCloud):
+        mask = crop_box_mask(pcd.point.positions.numpy(), bounds)
+        return pcd.select_by_mask(o3d.core.Tensor(mask))
+    return pcd.select_by_index(np.flatnonzero(crop_box_mask(np.asarray(pcd.points), bounds)))
+
+def crop_box_filter_with_intensity(pcd, bounds, intensity):
+    """
+    apply_crop_box_filter for a legacy cloud with a separate per-point intensity array.
+    Returns (filtered_pcd, filtered_intensity).
+    """
+    mask = crop_box_mask(np.asarray(pcd.points), bounds)
+    return pcd.select_by_index(np.flatnonzero(mask)), np.asarray(intensity)[mask]
+
+def apply_crop_box_filter_batch(pcds, bounds):
+    """
+    Crop a list of legacy point clouds with one mask computed over all their points.
+    """
+    sizes = [len(pcd.points) for pcd in pcds]
+    if not pcds or sum(sizes) == 0:
+        return [o3d.geometry.PointCloud(pcd) for pcd in pcds]
+    masks = np.split(crop_box_mask(np.concatenate([np.asarray(pcd.points) for pcd in pcds]), bounds),
+                     np.cumsum(sizes)[:-1])
+    return [pcd.select_by_index(np.flatnonzero(mask)) for pcd, mask in zip(pcds, masks)]
 
 def apply_passthrough_filter(pcd, axis, min_val, max_val):
-    print(f"Applying pass-through filter on axis {axis} with bounds ({min_val}, {max_val})")
-    points = np.asarray(pcd.points)
-    if axis == 'y':
-        mask = np.logical_and(points[:, 1] >= min_val, points[:, 1] <= max_val)
-    elif axis == 'z':
-        mask = np.logical_and(points[:, 2] >= min_val, points[:, 2] <= max_val)
-    filtered_points = points[mask]
-    filtered_pcd = o3d.geometry.PointCloud()
-    filtered_pcd.points = o3d.utility.Vector3dVector(filtered_points)
-    return filtered_pcd
-
-def process_directory(input_dir, output_dir, y_bounds, z_bounds):
+    metrics.log(f"Applying pass-through filter on axis {axis} with bounds ({min_val}, {max_val})")
+    return apply_crop_box_filter(pcd, {axis: (min_val, max_val)})
+
+def process_directory(input_dir, output_dir, y_bounds, z_bounds, cache=None, write_workers=2):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        print(f"Created output directory: {output_dir}")
-    print(f"Starting processing of directory: {input_dir}")
+        metrics.log(f"Created output directory: {output_dir}")
+    metrics.log(f"Starting processing of directory: {input_dir}")
+    # Outputs are written on background threads while the next files are processed
+    writer = AsyncWriter(workers=write_workers)
     for subdir, dirs, files in os.walk(input_dir):
+        # Frame stores are filtered frame by frame into a store of the same name
+        for input_store in take_frame_stores(subdir, dirs):
+            output_store = os.path.join(output_dir, os.path.relpath(input_store, input_dir))
+            params = {'y_bounds': list(y_bounds), 'z_bounds': list(z_bounds)}
+            store_index = os.path.join(input_store, INDEX_FILE)
+            if cache is not None and cache.lookup('passthrough_yz', store_index, params):
+                continue
+            metrics.log(f"Processing frame store: {input_store}")
+            with metrics.stage('crop_box_filter') as record:
+                record.points_in, record.points_out = transform_frame_store(
+                    input_store, output_store, lambda points: points[crop_box_mask(points, {'y': y_bounds, 'z': z_bounds})])
+            metrics.log(f"Saved filtered frame store to: {output_store}")
+            if cache is not None:
+                cache.record('passthrough_yz', store_index, params, outputs=store_files(output_store))
         for filename in files:
-            if filename.endswith('.pcd'):
+            # Dot-files are temporary files of writes still in progress
+            if filename.endswith('.pcd') and not filename.startswith('.'):
                 file_path = os.path.join(subdir, filename)
-                print(f"Processing file: {file_path}")
-                pcd = o3d.io.read_point_cloud(file_path)
-                pcd = apply_passthrough_filter(pcd, 'y', *y_bounds)
-                pcd = apply_passthrough_filter(pcd, 'z', *z_bounds)
+                params = {'y_bounds': list(y_bounds), 'z_bounds': list(z_bounds)}
+                if cache is not None and cache.lookup('passthrough_yz', file_path, params):
+                    continue
+                metrics.log(f"Processing file: {file_path}")
+                pcd = read_point_cloud(file_path)
+                # Apply the y and z bounds as one crop box
+                with metrics.stage('crop_box_filter', points_in=len(pcd.points)) as record:
+                    pcd = apply_crop_box_filter(pcd, {'y': y_bounds, 'z': z_bounds})
+                    record.points_out = len(pcd.points)
                 relative_path = os.path.relpath(subdir, input_dir)
                 output_subdir = os.path.join(output_dir, relative_path)
                 if not os.path.exists(output_subdir):
                     os.makedirs(output_subdir)
-                    print(f"Created subdirectory for output: {output_subdir}")
+                    metrics.log(f"Created subdirectory for output: {output_subdir}")
                 output_path = os.path.join(output_subdir, filename)
-                o3d.io.write_point_cloud(output_path, pcd)
-                print(f"Saved filtered PCD to: {output_path}")
-    print("Finished processing all files.")
-
-input_dir = '/home/jetson/SYDE675_project/syde_675_data/processed_pointclouds_combined'
-output_dir = '/home/jetson/SYDE675_project/syde_675_data/pcd_passthrough_filtered'
-y_bounds = (-0.7, 0.7)
-z_bounds = (-1.0, 0.3)
-process_directory(input_dir, output_dir, y_bounds, z_bounds)
\ No newline at end of file
+                writer.write_point_cloud(output_path, pcd)
+                metrics.log(f"Queued filtered PCD for writing to: {output_path}")
+                if cache is not None:
+                    cache.record('passthrough_yz', file_path, params, outputs=[output_path])
+    # Entries are only saved once every queued write has succeeded
+    writer.close()
+    if cache is not None:
+        cache.save()
+        metrics.log(cache.summary())
+    metrics.log("Finished processing all files.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
+    input_dir = '/home/jetson/SYDE675_project/syde_675_data/processed_pointclouds_combined'
+    output_dir = '/home/jetson/SYDE675_project/syde_675_data/pcd_passthrough_filtered'
+    y_bounds = (-0.7, 0.7)
+    z_bounds = (-1.0, 0.3)
+    cache = StageCache(os.path.join(output_dir, 'stage_cache.json'))
+    with profiled(args.profile):
+        process_directory(input_dir, output_dir, y_bounds, z_bounds, cache=cache)
+    metrics.report(args.metrics)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pcd_filter_passthrough import apply_crop_box_filter
+from pcd_downsampling import apply_voxel_downsampling
+from pca_on_pcd_saving_to_csv import determine_label, extract_pca_features, save_pca_results
+from stage_cache import StageCache
+from pca_feature_engine import FEATURE_VERSION
+from feature_store import write_feature_partition
+from async_writer import AsyncWriter
+from pipeline_metrics import metrics, read_point_cloud, write_point_cloud, profiled, add_metrics_arguments, configure_metrics
+
+# Stage settings used when the config file does not override them.
+# A stage is skipped when its setting is empty; an output is written only when its path is set.
+DEFAULT_CONFIG = {
+    'input_dir': '~/SYDE675_project/syde_675_data/processed_pointclouds_combined',
+    'passthrough_bounds': {'x': [0.0, 2.5]},
+    'voxel_size': None,
+    'compute_features': True,
+    'outputs': {
+        'filtered_dir': None,
+        'downsampled_dir': None,
+        'features_csv': '~/SYDE675_project/syde_675_data/pca_features_with_labels.csv',
+        'features_store': None,
+    },
+    'workers': os.cpu_count() or 1,
+    # Manifest of already processed files; set to null to always reprocess everything
+    'cache_manifest': '~/SYDE675_project/syde_675_data/pipeline_stage_cache.json',
+    'cache_use_content_hash': False,
+}
+
+def load_config(config_path=None):
+    """Load a JSON pipeline config on top of the defaults and expand user paths."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if config_path:
+        with open(config_path) as f:
+            overrides = json.load(f)
+        outputs = overrides.pop('outputs', {})
+        config.update(overrides)
+        config['outputs'].update(outputs)
+    config['input_dir'] = os.path.expanduser(config['input_dir'])
+    if config['cache_manifest']:
+        config['cache_manifest'] = os.path.expanduser(config['cache_manifest'])
+    config['outputs'] = {name: os.path.expanduser(path) if path else None
+                         for name, path in config['outputs'].items()}
+    return config
+
+def find_pcd_files(input_dir):
+    """List every PCD file below input_dir."""
+    pcd_files = []
+    for subdir, dirs, files in os.walk(input_dir):
+        for filename in sorted(files):
+            # Dot-files are temporary files of writes still in progress
+            if filename.endswith('.pcd') and not filename.startswith('.'):
+                pcd_files.append(os.path.join(subdir, filename))
+    return sorted(pcd_files)
+
+def pipeline_stages(pcd_file, config):
+    """
+    The cached stages the config enables for one input, as (stage, params, outputs).
+    A stage's params are the settings its output depends on, those of the stages
+    before it included, so a change only rebuilds the outputs it affects.
+    """
+    relative_path = os.path.relpath(pcd_file, config['input_dir'])
+    outputs = config['outputs']
+    params = {'passthrough_bounds': config['passthrough_bounds']}
+    stages = []
+    if outputs.get('filtered_dir'):
+        stages.append(('pipeline_filter', dict(params), [os.path.join(outputs['filtered_dir'], relative_path)]))
+    params['voxel_size'] = config['voxel_size']
+    if config['voxel_size'] and outputs.get('downsampled_dir'):
+        stages.append(('pipeline_downsample', dict(params), [os.path.join(outputs['downsampled_dir'], relative_path)]))
+    if config['compute_features']:
+        params['feature_version'] = FEATURE_VERSION
+        stages.append(('pipeline_features', params, []))
+    return stages
+
+def write_stage_output(pcd, output_dir, relative_path, writer=None):
+    """
+    Write one stage's cloud under output_dir, mirroring the input tree, through the
+    background writer when one is given.
+    """
+    output_path = os.path.join(output_dir, relative_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if writer is not None:
+        writer.write_point_cloud(output_path, pcd)
+    else:
+        write_point_cloud(output_path, pcd)
+
+def process_file(pcd_file, config, stages=None, writer=None):
+    """
+    Run the configured stages on one PCD file in memory.
+    stages names the pipeline_stages whose outputs are needed (all by default); the
+    crop and downsampling still run when a later stage needs their result.
+    Returns the file's PCA feature row, or None when features are not computed.
+    With a writer, the stage outputs are written in the background; the caller
+    must close or flush it before relying on them.
+    """
+    def needed(stage):
+        return stages is None or stage in stages
+
+    relative_path = os.path.relpath(pcd_file, config['input_dir'])
+    outputs = config['outputs']
+    pcd = read_point_cloud(pcd_file)
+
+    if config['passthrough_bounds']:
+        with metrics.stage('crop_box_filter', points_in=len(pcd.points)) as record:
+            pcd = apply_crop_box_filter(pcd, config['passthrough_bounds'])
+            record.points_out = len(pcd.points)
+    if outputs.get('filtered_dir') and needed('pipeline_filter'):
+        write_stage_output(pcd, outputs['filtered_dir'], relative_path, writer)
+
+    compute_features = config['compute_features'] and needed('pipeline_features')
+    if config['voxel_size'] and (compute_features or needed('pipeline_downsample')):
+        with metrics.stage('voxel_downsampling', points_in=len(pcd.points)) as record:
+            pcd = apply_voxel_downsampling(pcd, config['voxel_size'])
+            record.points_out = len(pcd.points)
+        if outputs.get('downsampled_dir') and needed('pipeline_downsample'):
+            write_stage_output(pcd, outputs['downsampled_dir'], relative_path, writer)
+
+    if compute_features and len(pcd.points) > 0:
+        # Frames are labelled by the bag directory they were converted into
+        label = determine_label(relative_path.split(os.sep)[0])
+        with metrics.stage('pca_features', points_in=len(pcd.points)):
+            return extract_pca_features(pcd, label)
+    return None
+
+# Background writer of a pool worker process
+_worker_writer = None
+
+# Files handed to a pool worker at a time
+WORKER_CHUNK_SIZE = 16
+
+def _process_chunk_with_config(tasks):
+    # Writes overlap with the next files of the chunk, and all outputs are on disk
+    # before the parent records the chunk's files in the cache
+    rows = [process_file(*task, writer=_worker_writer) for task in tasks]
+    _worker_writer.flush()
+    # Stage totals travel back with the results, since each worker has its own metrics
+    return rows, metrics.snapshot()
+
+def _configure_worker(metrics_options):
+    global _worker_writer
+    metrics.configure(**metrics_options)
+    metrics.reset()
+    _worker_writer = AsyncWriter()
+
+def run_pipeline(config):
+    """Process every PCD file under the configured input directory and save the requested outputs."""
+    pcd_files = find_pcd_files(config['input_dir'])
+    cache = None
+    if config['cache_manifest']:
+        cache = StageCache(config['cache_manifest'], use_content_hash=config['cache_use_content_hash'])
+
+    # Each stage is reused separately while its input and settings are unchanged
+    cached_rows, pending, file_stages = {}, [], {}
+    for pcd_file in pcd_files:
+        stages = file_stages[pcd_file] = pipeline_stages(pcd_file, config)
+        stale = []
+        for stage, params, outputs in stages:
+            entry = cache.lookup(stage, pcd_file, params, outputs) if cache is not None else None
+            if entry is None:
+                stale.append(stage)
+            elif stage == 'pipeline_features':
+                cached_rows[pcd_file] = entry['result']
+        if stale:
+            pending.append((pcd_file, stale))
+    metrics.log(f"Running pipeline on {len(pending)} of {len(pcd_files)} PCD file(s) with {config['workers']} worker(s)")
+
+    tasks = [(pcd_file, config, stale) for pcd_file, stale in pending]
+    if config['workers'] > 1:
+        with ProcessPoolExecutor(max_workers=config['workers'], initializer=_configure_worker,
+                                 initargs=(metrics.worker_options(),)) as executor:
+            chunks = [tasks[start:start + WORKER_CHUNK_SIZE] for start in range(0, len(tasks), WORKER_CHUNK_SIZE)]
+            results = list(executor.map(_process_chunk_with_config, chunks))
+        rows = []
+        for chunk_rows, stages in results:
+            rows.extend(chunk_rows)
+            metrics.merge(stages)
+    else:
+        with AsyncWriter(workers=2) as writer:
+            rows = [process_file(*task, writer=writer) for task in tasks]
+
+    for (pcd_file, stale), row in zip(pending, rows):
+        if 'pipeline_features' in stale:
+            cached_rows[pcd_file] = row
+        if cache is not None:
+            for stage, params, outputs in file_stages[pcd_file]:
+                if stage in stale:
+                    cache.record(stage, pcd_file, params, outputs=outputs,
+                                 result=row if stage == 'pipeline_features' else None)
+    if cache is not None:
+        cache.save()
+        metrics.log(cache.summary())
+
+    pca_results = []
+    partitions = {}
+    for pcd_file in pcd_files:
+        row = cached_rows.get(pcd_file)
+        if row is not None:
+            pca_results.append(row)
+            partition = os.path.relpath(pcd_file, config['input_dir']).split(os.sep)[0]
+            partitions.setdefault(partition, []).append(row)
+    if config['compute_features'] and config['outputs'].get('features_csv'):
+        save_pca_results(pca_results, config['outputs']['features_csv'])
+    if config['compute_features'] and config['outputs'].get('features_store'):
+        for partition, rows in partitions.items():
+            write_feature_partition(rows, config['outputs']['features_store'], partition, mode='overwrite')
+        metrics.log(f"Saved {len(partitions)} feature partition(s) to {config['outputs']['features_store']}")
+    metrics.log("Finished processing all files.")
+    return pca_results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filter, downsample and extract PCA features from PCD files in one pass.")
+    parser.add_argument("--config", help="JSON file overriding DEFAULT_CONFIG")
+    parser.add_argument("--print-default-config", action="store_true")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
+    if args.print_default_config:
+        json.dump(DEFAULT_CONFIG, sys.stdout, indent=4)
+        print()
+        sys.exit(0)
+    with profiled(args.profile):
+        run_pipeline(load_config(args.config))
+    metrics.report(args.metrics)
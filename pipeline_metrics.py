@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+import contextlib
+import open3d as o3d
+
+COUNTERS = ('points_in', 'points_out', 'bytes_read', 'bytes_written')
+# Stage events buffered before they are appended to the events file
+EVENT_BUFFER_LINES = 1024
+
+class StageRecord:
+    """Counters of one timed stage call; the caller fills in what it knows."""
+    __slots__ = COUNTERS
+
+    def __init__(self, points_in=0, bytes_read=0):
+        self.points_in = points_in
+        self.points_out = 0
+        self.bytes_read = bytes_read
+        self.bytes_written = 0
+
+class PipelineMetrics:
+    """
+    Per-stage timers and counters shared by all pipeline scripts.
+
+    Stages are timed with `with metrics.stage(name) as record:` and accumulate call
+    counts, total and maximum time, and points and bytes in and out. Progress messages
+    go through log(), which does nothing in quiet mode, so hot loops pay no console
+    I/O. Totals can be printed as a table or written as JSON lines; with events
+    enabled, every stage call is also written as its own JSON line. Worker processes
+    append their events to the same file; buffered lines are written in one call to a
+    file opened for appending, so lines from different processes never interleave.
+    """
+
+    def __init__(self):
+        self.quiet = False
+        self.stages = {}
+        # Writer and reader threads record stages too
+        self._lock = threading.Lock()
+        self.events_path = None
+        self._events_fd = None
+        self._event_lines = []
+        self._start = time.perf_counter()
+
+    def configure(self, quiet=None, events_path=None):
+        if quiet is not None:
+            self.quiet = quiet
+        if events_path and events_path != self.events_path:
+            self._events_fd = os.open(events_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.events_path = events_path
+
+    def worker_options(self):
+        """Keyword arguments for configure() in a worker process, so it logs and records events alike."""
+        return {'quiet': self.quiet, 'events_path': self.events_path}
+
+    def log(self, message):
+        if not self.quiet:
+            print(message)
+
+    def _totals(self, name):
+        totals = self.stages.get(name)
+        if totals is None:
+            totals = self.stages[name] = dict(calls=0, seconds=0.0, max_seconds=0.0, **{c: 0 for c in COUNTERS})
+        return totals
+
+    @contextlib.contextmanager
+    def stage(self, name, points_in=0, bytes_read=0):
+        record = StageRecord(points_in, bytes_read)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                totals = self._totals(name)
+                totals['calls'] += 1
+                totals['seconds'] += elapsed
+                totals['max_seconds'] = max(totals['max_seconds'], elapsed)
+                for counter in COUNTERS:
+                    totals[counter] += getattr(record, counter)
+                if self._events_fd is not None:
+                    event = {'stage': name, 'seconds': elapsed}
+                    event.update((counter, getattr(record, counter)) for counter in COUNTERS)
+                    self._event_lines.append(json.dumps(event) + '\n')
+                    if len(self._event_lines) >= EVENT_BUFFER_LINES:
+                        self._flush_events()
+
+    def _flush_events(self):
+        # Called with the lock held
+        if self._event_lines:
+            os.write(self._events_fd, ''.join(self._event_lines).encode())
+            self._event_lines = []
+
+    def count(self, name, **counters):
+        """Add to a stage's counters without timing anything."""
+        with self._lock:
+            totals = self._totals(name)
+            for counter, value in counters.items():
+                totals[counter] = totals.get(counter, 0) + value
+
+    def reset(self):
+        """
+        Drop the totals and buffered events, e.g. those a forked worker process inherited
+        from its parent, which reports them itself.
+        """
+        with self._lock:
+            self.stages = {}
+            self._event_lines = []
+
+    def snapshot(self, reset=True):
+        """
+        Return the accumulated totals, e.g. to send them back from a worker process.
+        Buffered events are written out too, since worker processes exit without cleanup.
+        """
+        with self._lock:
+            stages = {name: dict(totals) for name, totals in self.stages.items()}
+            if reset:
+                self.stages = {}
+            if self._events_fd is not None:
+                self._flush_events()
+        return stages
+
+    def merge(self, stages):
+        """Add totals collected elsewhere (typically by a worker process)."""
+        for name, other in stages.items():
+            totals = self._totals(name)
+            for key, value in other.items():
+                totals[key] = max(totals[key], value) if key == 'max_seconds' else totals.get(key, 0) + value
+
+    @staticmethod
+    def peak_rss_mb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def summary_table(self):
+        lines = [f"{'stage':<28} {'calls':>8} {'total [s]':>10} {'mean [ms]':>10} {'max [ms]':>10} "
+                 f"{'points in':>12} {'points out':>12} {'MB read':>9} {'MB written':>10}"]
+        for name, t in self.stages.items():
+            mean_ms = t['seconds'] / t['calls'] * 1e3 if t['calls'] else 0.0
+            lines.append(f"{name:<28} {t['calls']:>8} {t['seconds']:>10.2f} {mean_ms:>10.2f} "
+                         f"{t['max_seconds'] * 1e3:>10.2f} {t['points_in']:>12} {t['points_out']:>12} "
+                         f"{t['bytes_read'] / 1e6:>9.1f} {t['bytes_written'] / 1e6:>10.1f}")
+        lines.append(f"wall time {time.perf_counter() - self._start:.1f}s, peak RSS {self.peak_rss_mb():.0f} MB")
+        return "\n".join(lines)
+
+    def report(self, summary_path=None):
+        """Print the summary table (even in quiet mode) and optionally write it as JSON lines."""
+        print(self.summary_table(), file=sys.stderr if self.quiet else sys.stdout)
+        if summary_path:
+            with open(summary_path, 'w') as f:
+                for name, totals in self.stages.items():
+                    f.write(json.dumps(dict(stage=name, **totals)) + '\n')
+                f.write(json.dumps({'stage': 'process', 'peak_rss_mb': self.peak_rss_mb(),
+                                    'wall_seconds': time.perf_counter() - self._start}) + '\n')
+        if self._events_fd is not None:
+            with self._lock:
+                self._flush_events()
+
+# Shared instance used by every script
+metrics = PipelineMetrics()
+
+def read_point_cloud(file_path, stage='read_pcd'):
+    """o3d.io.read_point_cloud recorded as a stage with its bytes read and points loaded."""
+    with metrics.stage(stage, bytes_read=os.path.getsize(file_path)) as record:
+        pcd = o3d.io.read_point_cloud(file_path)
+        record.points_out = len(pcd.points)
+    return pcd
+
+def temporary_path(output_path):
+    """
+    Hidden name next to output_path for atomic writes. It keeps the extension, since
+    Open3D picks the file format from it; the directory walkers skip dot-files.
+    """
+    directory, filename = os.path.split(output_path)
+    return os.path.join(directory, f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp{os.path.splitext(filename)[1]}")
+
+def write_point_cloud(output_path, pcd, stage='write_pcd'):
+    """
+    o3d.io.write_point_cloud recorded as a stage with its points and bytes written.
+    The cloud is written to a temporary name and renamed, so an interrupted run never
+    leaves a truncated file under the final name.
+    """
+    tmp_path = temporary_path(output_path)
+    with metrics.stage(stage, points_in=len(pcd.points)) as record:
+        success = o3d.io.write_point_cloud(tmp_path, pcd)
+        if success:
+            os.replace(tmp_path, output_path)
+            record.bytes_written = os.path.getsize(output_path)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return success
+
+@contextlib.contextmanager
+def profiled(output_path=None, top=25):
+    """
+    Run the enclosed block under cProfile when output_path is set, save the stats there
+    and print the most expensive functions. Does nothing otherwise.
+    """
+    if not output_path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(top)
+
+def add_metrics_arguments(parser):
+    """Add the shared --quiet, --metrics, --metrics-events and --profile options to a parser."""
+    parser.add_argument("--quiet", action="store_true", help="No per-file logging")
+    parser.add_argument("--metrics", help="Write per-stage totals to this JSON lines file")
+    parser.add_argument("--metrics-events", help="Append one JSON line per stage call to this file")
+    parser.add_argument("--profile", help="Run under cProfile and save the stats to this file")
+
+def configure_metrics(args):
+    metrics.configure(quiet=args.quiet, events_path=args.metrics_events)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import sys
+import numpy as np
+import open3d as o3d
+
+# sensor_msgs/PointField datatype constants mapped to NumPy scalar types
+POINT_FIELD_DTYPES = {
+    1: np.int8,     # INT8
+    2: np.uint8,    # UINT8
+    3: np.int16,    # INT16
+    4: np.uint16,   # UINT16
+    5: np.int32,    # INT32
+    6: np.uint32,   # UINT32
+    7: np.float32,  # FLOAT32
+    8: np.float64,  # FLOAT64
+}
+
+# Optional per-point fields carried alongside x/y/z when the sensor provides them
+DEFAULT_EXTRA_FIELDS = ("intensity", "ring")
+
+def pointcloud2_dtype(point_cloud_msg):
+    """
+    Build a NumPy structured dtype describing one point of a PointCloud2 message.
+    Padding between fields and at the end of each point is preserved through
+    explicit offsets and an itemsize equal to point_step.
+    """
+    byte_order = '>' if point_cloud_msg.is_bigendian else '<'
+    names, formats, offsets = [], [], []
+    for field in point_cloud_msg.fields:
+        if field.datatype not in POINT_FIELD_DTYPES:
+            raise ValueError(f"Unsupported PointField datatype {field.datatype} for field '{field.name}'")
+        scalar = np.dtype(POINT_FIELD_DTYPES[field.datatype]).newbyteorder(byte_order)
+        names.append(field.name)
+        formats.append(scalar if field.count <= 1 else (scalar, (field.count,)))
+        offsets.append(field.offset)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': point_cloud_msg.point_step})
+
+def pointcloud2_to_structured_array(point_cloud_msg):
+    """
+    View the raw bytes of a PointCloud2 message as a (height, width) structured array.
+    No data is copied: row padding is handled through strides rather than slicing.
+    """
+    dtype = pointcloud2_dtype(point_cloud_msg)
+    height, width = point_cloud_msg.height, point_cloud_msg.width
+    row_step = point_cloud_msg.row_step or point_cloud_msg.point_step * width
+    if height == 0 or width == 0:
+        return np.empty((0, 0), dtype=dtype)
+    return np.ndarray(shape=(height, width), dtype=dtype, buffer=point_cloud_msg.data,
+                      strides=(row_step, point_cloud_msg.point_step))
+
+def decode_point_cloud2(point_cloud_msg, extra_fields=DEFAULT_EXTRA_FIELDS, skip_nans=True):
+    """
+    Decode a PointCloud2 message into an (N, 3) float64 array of xyz coordinates and
+    a dict of 1-D arrays for the requested extra fields that exist in the message.
+    Points with a NaN coordinate are dropped when skip_nans is set.
+    """
+    cloud = pointcloud2_to_structured_array(point_cloud_msg).reshape(-1)
+    xyz = np.empty((cloud.shape[0], 3), dtype=np.float64)
+    xyz[:, 0] = cloud['x']
+    xyz[:, 1] = cloud['y']
+    xyz[:, 2] = cloud['z']
+
+    available = [name for name in extra_fields if name in cloud.dtype.names]
+    if skip_nans:
+        mask = ~np.isnan(xyz).any(axis=1)
+        if not mask.all():
+            xyz = xyz[mask]
+            cloud = cloud[mask]
+    # Copy extras out of the message buffer in native byte order
+    extras = {}
+    for name in available:
+        values = cloud[name]
+        extras[name] = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('='))
+    return xyz, extras
+
+def ros_point_cloud2_to_o3d(point_cloud_msg):
+    """
+    Convert a sensor_msgs/PointCloud2 message to an Open3D PointCloud.
+    """
+    points, _ = decode_point_cloud2(point_cloud_msg, extra_fields=())
+    o3d_pcd = o3d.geometry.PointCloud()
+    o3d_pcd.points = o3d.utility.Vector3dVector(points)
+    return o3d_pcd
+
+if __name__ == "__main__":
+    # Quick check against a bag: decode the first message of a topic and report field layout
+    import rosbag
+
+    if len(sys.argv) < 2:
+        print("Usage: pointcloud2_decoder.py <bag_file> [topic]")
+        sys.exit(1)
+    topic_name = sys.argv[2] if len(sys.argv) > 2 else "/scan_3D"
+    with rosbag.Bag(sys.argv[1], "r") as bag:
+        for topic, msg, t in bag.read_messages(topics=[topic_name]):
+            points, extras = decode_point_cloud2(msg)
+            print(f"Fields: {[f.name for f in msg.fields]}")
+            print(f"Decoded {len(points)} finite points of {msg.width * msg.height}")
+            for name, values in extras.items():
+                print(f"  {name}: dtype={values.dtype}, min={values.min()}, max={values.max()}")
+            break
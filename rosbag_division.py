@@ -1,52 +1,92 @@
 import rosbag
+import genpy
 import os
 import glob
+from bisect import bisect_left
 from datetime import datetime
+import argparse
+from pipeline_metrics import metrics, profiled, add_metrics_arguments, configure_metrics
 
-def segment_rosbag(original_bag_path, cutoff_time, before_bag_path, after_bag_path):
+def slice_rosbag(original_bag_path, cut_times, output_paths, topics=None):
     """
-    Segments a ROS bag into two parts based on a specified cutoff time.
+    Splits a ROS bag into len(cut_times) + 1 segments in a single pass.
+    cut_times are seconds from the start of the bag, in increasing order; segment i holds
+    the messages with cut_times[i - 1] < t <= cut_times[i]. An output path of None skips
+    that segment. Only the time range and topics that are written are read, using the
+    bag's chunk index, and messages are copied as raw bytes without being deserialized.
     """
-    print("Opening original rosbag:", original_bag_path)
+    if len(output_paths) != len(cut_times) + 1:
+        raise ValueError("Expected one output path per segment (len(cut_times) + 1)")
+    if list(cut_times) != sorted(cut_times):
+        raise ValueError("cut_times must be increasing")
+
+    metrics.log(f"Opening original rosbag: {original_bag_path}")
     with rosbag.Bag(original_bag_path, 'r') as original_bag:
-        start_time = original_bag.get_start_time()
-        cutoff_time_rospy = start_time + cutoff_time
-        print(f"Segmenting rosbag at {datetime.utcfromtimestamp(cutoff_time_rospy).strftime('%Y-%m-%d %H:%M:%S')} (UTC)")
-        
-        with rosbag.Bag(before_bag_path, 'w') as before_bag, rosbag.Bag(after_bag_path, 'w') as after_bag:
-            for topic, msg, t in original_bag.read_messages():
-                if t.to_sec() <= cutoff_time_rospy:
-                    before_bag.write(topic, msg, t)
-                else:
-                    after_bag.write(topic, msg, t)
-                    
-    print("Segmentation completed.")
-    print("Segmented rosbags saved to:", os.path.dirname(before_bag_path))
+        bag_start = original_bag.get_start_time()
+        cuts = [bag_start + cut for cut in cut_times]
+        cut_stamps = ', '.join(datetime.utcfromtimestamp(cut).strftime('%Y-%m-%d %H:%M:%S') for cut in cuts)
+        metrics.log(f"Cutting rosbag at {cut_stamps} (UTC)")
+
+        # Restrict the read to the range covered by the segments that are written
+        wanted = [i for i, path in enumerate(output_paths) if path is not None]
+        if not wanted:
+            return
+        start_time = genpy.Time.from_sec(cuts[wanted[0] - 1]) if wanted[0] > 0 else None
+        end_time = genpy.Time.from_sec(cuts[wanted[-1]]) if wanted[-1] < len(cuts) else None
+
+        output_bags = [rosbag.Bag(path, 'w') if path is not None else None for path in output_paths]
+        try:
+            with metrics.stage('slice_rosbag') as record:
+                for topic, raw_msg, t, connection_header in original_bag.read_messages(
+                        topics=topics, start_time=start_time, end_time=end_time,
+                        raw=True, return_connection_header=True):
+                    output_bag = output_bags[bisect_left(cuts, t.to_sec())]
+                    record.bytes_read += len(raw_msg[1])
+                    if output_bag is not None:
+                        output_bag.write(topic, raw_msg, t, raw=True, connection_header=connection_header)
+                        record.bytes_written += len(raw_msg[1])
+        finally:
+            for output_bag in output_bags:
+                if output_bag is not None:
+                    output_bag.close()
 
-def crop_rosbag(original_bag_path, cutoff_time, cropped_bag_path):
+def segment_rosbag(original_bag_path, cutoff_time, before_bag_path, after_bag_path, topics=None):
+    """
+    Segments a ROS bag into two parts based on a specified cutoff time.
+    """
+    metrics.log(f"Segmenting rosbag {cutoff_time} s after its start")
+    slice_rosbag(original_bag_path, [cutoff_time], [before_bag_path, after_bag_path], topics)
+
+    metrics.log("Segmentation completed.")
+    metrics.log(f"Segmented rosbags saved to: {os.path.dirname(before_bag_path)}")
+
+def crop_rosbag(original_bag_path, cutoff_time, cropped_bag_path, topics=None):
     """
     Creates a new cropped rosbag with data from the start until the specified cutoff time.
     """
-    print("Opening original rosbag for cropping:", original_bag_path)
-    with rosbag.Bag(original_bag_path, 'r') as original_bag:
-        start_time = original_bag.get_start_time()
-        cutoff_time_rospy = start_time + cutoff_time
-        print(f"Cropping rosbag at {datetime.utcfromtimestamp(cutoff_time_rospy).strftime('%Y-%m-%d %H:%M:%S')} (UTC)")
+    metrics.log(f"Cropping rosbag {cutoff_time} s after its start")
+    slice_rosbag(original_bag_path, [cutoff_time], [cropped_bag_path, None], topics)
 
-        with rosbag.Bag(cropped_bag_path, 'w') as cropped_bag:
-            for topic, msg, t in original_bag.read_messages():
-                if t.to_sec() <= cutoff_time_rospy:
-                    cropped_bag.write(topic, msg, t)
-                else:
-                    break  # Stop processing once the cutoff time is reached
-                    
-    print("Cropping completed.")
-    print("Cropped rosbag saved to:", cropped_bag_path)
+    metrics.log("Cropping completed.")
+    metrics.log(f"Cropped rosbag saved to: {cropped_bag_path}")
 
-def process_directory(directory_path, cutoff_time, operation="segment"):
+def split_rosbag(original_bag_path, segment_times, output_directory, topics=None):
+    """
+    Splits a ROS bag at every time in segment_times (seconds from the start) and
+    returns the paths of the len(segment_times) + 1 segment bags.
+    """
+    base_name = os.path.splitext(os.path.basename(original_bag_path))[0]
+    output_paths = [os.path.join(output_directory, f"{base_name}_part{i}.bag")
+                    for i in range(len(segment_times) + 1)]
+    slice_rosbag(original_bag_path, segment_times, output_paths, topics)
+    metrics.log(f"Split rosbag into {len(output_paths)} segments in {output_directory}")
+    return output_paths
+
+def process_directory(directory_path, cutoff_time, operation="segment", topics=None):
     """
     Processes all rosbag files in the specified directory, applying the chosen operation based on the cutoff time,
     and saves the new files in a corresponding subdirectory.
+    For operation="split", cutoff_time is a list of cut times and each bag is split into that many + 1 parts.
     """
     directory_path = os.path.expanduser(directory_path)
     bag_files = glob.glob(os.path.join(directory_path, '*.bag'))
@@ -55,8 +95,10 @@ def process_directory(directory_path, cutoff_time, operation="segment"):
         new_dir_path = os.path.join(directory_path, 'segmented_rosbags')
     elif operation == "crop":
         new_dir_path = os.path.join(directory_path, 'cropped_rosbags')
+    elif operation == "split":
+        new_dir_path = os.path.join(directory_path, 'split_rosbags')
     else:
-        print(f"Invalid operation: {operation}")
+        metrics.log(f"Invalid operation: {operation}")
         return
     
     if not os.path.exists(new_dir_path):
@@ -67,17 +109,30 @@ def process_directory(directory_path, cutoff_time, operation="segment"):
         if operation == "segment":
             before_bag_path = os.path.join(new_dir_path, f"{base_name}_before.bag")
             after_bag_path = os.path.join(new_dir_path, f"{base_name}_after.bag")
-            segment_rosbag(bag_file, cutoff_time, before_bag_path, after_bag_path)
+            segment_rosbag(bag_file, cutoff_time, before_bag_path, after_bag_path, topics)
         elif operation == "crop":
             cropped_bag_path = os.path.join(new_dir_path, f"{base_name}_cropped.bag")
-            crop_rosbag(bag_file, cutoff_time, cropped_bag_path)
+            crop_rosbag(bag_file, cutoff_time, cropped_bag_path, topics)
+        elif operation == "split":
+            split_rosbag(bag_file, cutoff_time, new_dir_path, topics)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
+    # Example usage
+    directory_path = '~/rosbags/different_surfaces'
+    cutoff_time = 30  # Adjust this cutoff time as needed for your scenario
 
-# Example usage
-directory_path = '~/rosbags/different_surfaces'
-cutoff_time = 30  # Adjust this cutoff time as needed for your scenario
+    # To segment the rosbags
+    # process_directory(directory_path, cutoff_time, operation="segment")
 
-# To segment the rosbags
-# process_directory(directory_path, cutoff_time, operation="segment")
+    # To split the rosbags into 10 s segments in one pass, keeping only the point clouds
+    # process_directory(directory_path, [10, 20, 30], operation="split", topics=["/scan_3D"])
 
-# To crop the rosbags
-process_directory(directory_path, cutoff_time, operation="crop")
\ No newline at end of file
+    # To crop the rosbags
+    with profiled(args.profile):
+        process_directory(directory_path, cutoff_time, operation="crop")
+    metrics.report(args.metrics)
@@ -1,64 +1,280 @@
 #!/usr/bin/env python3
 
 import rosbag
-import open3d as o3d
 import numpy as np
-import sensor_msgs.point_cloud2 as pc2
 import os
+import math
 import glob
+import time
+import argparse
+import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pointcloud2_decoder import ros_point_cloud2_to_o3d
+from grand_cloud_aggregation import GrandCloudAccumulator
+from octree_tiles import OctreeTileWriter, TILES_SUFFIX
+from frame_store import FrameStoreWriter, FRAME_STORE_SUFFIX
+from async_writer import AsyncWriter
+from keyframe_selection import KeyframeSelector, pose_from_message
+from pipeline_metrics import metrics, write_point_cloud, profiled, add_metrics_arguments, configure_metrics
 
-def ros_point_cloud2_to_o3d(point_cloud_msg):
-    """
-    Convert a sensor_msgs/PointCloud2 message to an Open3D PointCloud.
-    """
-    points = np.array(list(pc2.read_points(point_cloud_msg, skip_nans=True, field_names=("x", "y", "z"))))
-    o3d_pcd = o3d.geometry.PointCloud()
-    o3d_pcd.points = o3d.utility.Vector3dVector(points)
-    return o3d_pcd
+# Marks the end of a pipeline queue
+_END_OF_STREAM = object()
 
 def save_processed_point_cloud(o3d_pcd, output_directory, bag_file_name, msg_index):
     """
     Save the processed Open3D point cloud to a file with a unique index.
     """
-    if not os.path.exists(output_directory):
-        os.makedirs(output_directory)
+    os.makedirs(output_directory, exist_ok=True)
     output_file_path = os.path.join(output_directory, f"{os.path.splitext(bag_file_name)[0]}_{msg_index}.pcd")
-    o3d.io.write_point_cloud(output_file_path, o3d_pcd)
-    print(f"Saved {output_file_path}")
+    write_point_cloud(output_file_path, o3d_pcd)
+    metrics.log(f"Saved {output_file_path}")
+
+def _read_messages(bag_file, topic_name, message_queue, stop, errors, odometry_topic=None):
+    """
+    Reader stage: push raw bag messages onto the decode queue, each with the latest
+    odometry pose when an odometry topic is given.
+    """
+    try:
+        with rosbag.Bag(bag_file, "r") as bag:
+            topics = [topic_name] + ([odometry_topic] if odometry_topic else [])
+            index = 0
+            pose = None
+            for topic, msg, t in bag.read_messages(topics=topics):
+                if stop.is_set():
+                    break
+                if topic == odometry_topic:
+                    pose = pose_from_message(msg)
+                    continue
+                metrics.count('read_bag', calls=1, bytes_read=len(msg.data))
+                message_queue.put((index, msg, t.to_sec(), pose))
+                index += 1
+    except Exception as e:
+        errors.append(e)
+    finally:
+        message_queue.put(_END_OF_STREAM)
+
+def _append_to_frame_store(frame_store, o3d_pcd, timestamp, name):
+    with metrics.stage('write_frame_store', points_in=len(o3d_pcd.points)) as record:
+        frame_store.append(np.asarray(o3d_pcd.points), timestamp=timestamp, name=name)
+        record.bytes_written = len(o3d_pcd.points) * 3 * frame_store.dtype.itemsize
+
+def _frame_costs(write_stage):
+    """
+    Bytes written, seconds of write-thread time and seconds of aggregation spent so far
+    on frames. Writes run on the AsyncWriter threads, so their seconds add up across
+    threads and overlap with decoding; they are not wall-clock time.
+    """
+    write = metrics.stages.get(write_stage, {})
+    aggregation = metrics.stages.get('grand_aggregation', {})
+    return write.get('bytes_written', 0), write.get('seconds', 0.0), aggregation.get('seconds', 0.0)
 
-def process_rosbag(bag_file, topic_name, base_output_directory):
+def process_rosbag(bag_file, topic_name, base_output_directory, grand_voxel_size=None,
+                   queue_size=32, progress_interval=100, frame_store=False, write_workers=2, grand_tile_size=None,
+                   keyframes=None, odometry_topic=None):
     """
     Process a ROS bag file to convert all messages on a topic to PCD files and aggregate them.
+    Reading, decoding and writing run as a three-stage pipeline connected by bounded queues;
+    PCD files are written by write_workers background threads (see async_writer.py).
+    Frames are streamed into the grand cloud as they arrive; with grand_voxel_size set, the
+    grand cloud is voxel-reduced on the fly so its memory stays bounded. With grand_tile_size
+    set, the grand cloud is written as an octree tile store (<bag>_grand.tiles, see
+    octree_tiles.py) instead of one flat _grand.pcd file, so later crops read only the
+    tiles they need.
+    With frame_store set, the frames are packed into <bag>.frames next to the bag's output
+    directory (see frame_store.py) instead of being written as one PCD file each.
+    With keyframes set to a dict of KeyframeSelector options (see keyframe_selection.py),
+    frames too similar to the last kept one are neither written nor aggregated; kept
+    frames keep their message index in their names. Poses from odometry_topic are then
+    used as an extra check; odometry_topic without keyframes raises a ValueError.
+    Returns the number of frames and points converted and the elapsed time.
     """
+    if odometry_topic and keyframes is None:
+        raise ValueError("odometry_topic is only used by keyframe selection")
     bag_name = os.path.splitext(os.path.basename(bag_file))[0]
     output_directory = os.path.join(base_output_directory, bag_name)
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    bag = rosbag.Bag(bag_file, "r")
-    all_pcds = []
-    for index, (topic, msg, t) in enumerate(bag.read_messages(topics=[topic_name])):
-        o3d_pcd = ros_point_cloud2_to_o3d(msg)
-        save_processed_point_cloud(o3d_pcd, output_directory, bag_name, index)
-        all_pcds.append(o3d_pcd)
-    bag.close()
-
-    # Aggregate all PCDs into one grand PCD file
-    grand_pcd = o3d.geometry.PointCloud()
-    for pcd in all_pcds:
-        grand_pcd += pcd
-    grand_pcd_path = os.path.join(output_directory, f"{bag_name}_grand.pcd")
-    o3d.io.write_point_cloud(grand_pcd_path, grand_pcd)
-    print(f"Aggregated PCD saved to {grand_pcd_path}")
+    start_time = time.perf_counter()
+    message_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    reader_errors = []
+    store_writer = None
+    if frame_store:
+        store_writer = FrameStoreWriter(os.path.join(base_output_directory, bag_name + FRAME_STORE_SUFFIX))
+    # Frames must be appended to a store in order, so it gets a single writer thread
+    writer = AsyncWriter(workers=1 if store_writer else write_workers, queue_size=queue_size)
+    reader = threading.Thread(target=_read_messages, args=(bag_file, topic_name, message_queue, stop, reader_errors,
+                                                           odometry_topic), daemon=True)
+    reader.start()
+
+    if grand_tile_size:
+        grand_cloud = OctreeTileWriter(os.path.join(output_directory, f"{bag_name}_grand{TILES_SUFFIX}"),
+                                       tile_size=grand_tile_size, voxel_size=grand_voxel_size)
+    else:
+        grand_cloud = GrandCloudAccumulator(voxel_size=grand_voxel_size)
+    selector = KeyframeSelector(**keyframes) if keyframes is not None else None
+    write_stage = 'write_frame_store' if store_writer is not None else 'write_pcd'
+    costs_before = _frame_costs(write_stage)
+    num_frames = num_points = 0
+    try:
+        while True:
+            item = message_queue.get()
+            if item is _END_OF_STREAM:
+                break
+            index, msg, timestamp, pose = item
+            with metrics.stage('decode_pointcloud2', points_in=msg.width * msg.height) as record:
+                o3d_pcd = ros_point_cloud2_to_o3d(msg)
+                record.points_out = len(o3d_pcd.points)
+            if selector is not None:
+                with metrics.stage('keyframe_selection', points_in=len(o3d_pcd.points)) as record:
+                    keep = selector.is_keyframe(np.asarray(o3d_pcd.points), timestamp, pose)
+                    record.points_out = len(o3d_pcd.points) if keep else 0
+                if not keep:
+                    continue
+            if store_writer is not None:
+                writer.submit(_append_to_frame_store, store_writer, o3d_pcd, timestamp, f"{bag_name}_{index}")
+            else:
+                writer.submit(save_processed_point_cloud, o3d_pcd, output_directory, bag_name, index)
+            with metrics.stage('grand_aggregation', points_in=len(o3d_pcd.points)):
+                grand_cloud.add(np.asarray(o3d_pcd.points))
+            num_frames += 1
+            num_points += len(o3d_pcd.points)
+            if progress_interval and num_frames % progress_interval == 0:
+                elapsed = time.perf_counter() - start_time
+                metrics.log(f"[{bag_name}] {num_frames} frames, {num_frames / elapsed:.1f} frames/s, "
+                            f"{num_points / elapsed / 1e6:.2f} Mpoints/s")
+        writer.close()
+        if reader_errors:
+            raise reader_errors[0]
+        if store_writer is not None:
+            store_writer.close()
+    finally:
+        # Unblock the reader if decoding or writing stopped early
+        stop.set()
+        while reader.is_alive():
+            try:
+                message_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        writer.close(raise_errors=False)
+        if store_writer is not None:
+            # Releases the points file of a store that was not finalized above; no index is written
+            store_writer.abort()
+    if selector is not None:
+        # What an average kept frame cost tells how much the dropped ones would have cost
+        costs = np.subtract(_frame_costs(write_stage), costs_before) / max(selector.frames_kept, 1)
+        metrics.log(f"[{bag_name}] Keyframes: {selector.summary(*costs)}")
+
+    if grand_tile_size:
+        with metrics.stage('write_grand_tiles', points_in=grand_cloud.num_points_in):
+            grand_cloud.close()
+        metrics.log(f"Aggregated tiles saved to {grand_cloud.store_dir}")
+    else:
+        # Save the aggregated frames as one grand PCD file
+        grand_pcd = grand_cloud.to_point_cloud()
+        grand_pcd_path = os.path.join(output_directory, f"{bag_name}_grand.pcd")
+        write_point_cloud(grand_pcd_path, grand_pcd, stage='write_grand_pcd')
+        metrics.log(f"Aggregated PCD saved to {grand_pcd_path}")
+
+    elapsed = time.perf_counter() - start_time
+    metrics.log(f"[{bag_name}] Done: {num_frames} frames, {num_points} points in {elapsed:.1f}s "
+                f"({num_frames / max(elapsed, 1e-9):.1f} frames/s, {num_points / max(elapsed, 1e-9) / 1e6:.2f} Mpoints/s)")
+    result = {'bag': bag_file, 'frames': num_frames, 'points': num_points, 'seconds': elapsed}
+    if selector is not None:
+        result['dropped_frames'] = selector.frames_dropped
+    return result
+
+def _process_rosbag_in_worker(metrics_options, *args, **kwargs):
+    """Run process_rosbag in a pool process and return its stage totals with the result."""
+    metrics.configure(**metrics_options)
+    metrics.reset()
+    result = process_rosbag(*args, **kwargs)
+    result['metrics'] = metrics.snapshot()
+    return result
+
+def process_rosbags(bag_files, topic_name, base_output_directory, workers=1, grand_voxel_size=None,
+                    frame_store=False, grand_tile_size=None, keyframes=None, odometry_topic=None):
+    """
+    Convert several bags, one bag per worker process when workers > 1.
+    """
+    start_time = time.perf_counter()
+    results = []
+    if workers <= 1:
+        for bag_file in bag_files:
+            metrics.log(f"Processing {bag_file}...")
+            results.append(process_rosbag(bag_file, topic_name, base_output_directory, grand_voxel_size,
+                                          frame_store=frame_store, grand_tile_size=grand_tile_size,
+                                          keyframes=keyframes, odometry_topic=odometry_topic))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_process_rosbag_in_worker, metrics.worker_options(), bag_file, topic_name,
+                                       base_output_directory, grand_voxel_size, frame_store=frame_store,
+                                       grand_tile_size=grand_tile_size, keyframes=keyframes,
+                                       odometry_topic=odometry_topic): bag_file
+                       for bag_file in bag_files}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    metrics.merge(result.pop('metrics'))
+                    results.append(result)
+                except Exception as e:
+                    print(f"Failed to process {futures[future]}: {e}")
+    elapsed = time.perf_counter() - start_time
+    total_frames = sum(r['frames'] for r in results)
+    print(f"Converted {len(results)}/{len(bag_files)} bag(s), {total_frames} frames in {elapsed:.1f}s "
+          f"({total_frames / max(elapsed, 1e-9):.1f} frames/s overall)")
+    if keyframes is not None:
+        dropped = sum(r['dropped_frames'] for r in results)
+        print(f"Keyframe selection dropped {dropped} of {total_frames + dropped} frames as redundant")
+    return results
 
 if __name__ == "__main__":
-    source_directory = os.path.expanduser("~/SYDE675_project/syde_675_data")
+    parser = argparse.ArgumentParser(description="Convert PointCloud2 messages in rosbags to PCD files.")
+    parser.add_argument("--source-directory", default="~/SYDE675_project/syde_675_data")
+    parser.add_argument("--topic", default="/scan_3D")
+    parser.add_argument("--workers", type=int, default=1, help="Number of bags converted in parallel")
+    parser.add_argument("--grand-voxel-size", type=float, default=None,
+                        help="Voxel size used to reduce the aggregated grand cloud while streaming")
+    parser.add_argument("--grand-tile-size", type=float, default=None,
+                        help="Write the grand cloud as an octree tile store with tiles of this size in meters")
+    parser.add_argument("--frame-store", action="store_true",
+                        help="Pack each bag's frames into one <bag>.frames store instead of one PCD file per frame")
+    parser.add_argument("--keyframes", action="store_true",
+                        help="Skip frames too similar to the last kept one (see keyframe_selection.py)")
+    parser.add_argument("--keyframe-centroid", type=float, default=0.05, help="Centroid shift [m] that keeps a frame")
+    parser.add_argument("--keyframe-bbox", type=float, default=0.1, help="Bounding box corner shift [m] that keeps a frame")
+    parser.add_argument("--keyframe-cell", type=float, default=0.2, help="Cell size [m] of the occupancy comparison")
+    parser.add_argument("--keyframe-overlap", type=float, default=0.9,
+                        help="Occupied-cell overlap at or above which a frame counts as redundant")
+    parser.add_argument("--keyframe-max-interval", type=float, default=None, help="Keep at least one frame every this many seconds")
+    parser.add_argument("--odometry-topic", help="Odometry topic whose pose change also keeps frames")
+    parser.add_argument("--keyframe-translation", type=float, default=0.1, help="Odometry translation [m] that keeps a frame")
+    parser.add_argument("--keyframe-rotation", type=float, default=5.0, help="Odometry rotation [deg] that keeps a frame")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    if args.odometry_topic and not args.keyframes:
+        parser.error("--odometry-topic is only used with --keyframes")
+    configure_metrics(args)
+
+    source_directory = os.path.expanduser(args.source_directory)
     base_output_directory = os.path.join(source_directory, "processed_pointclouds_combined")
-    point_cloud_topic = "/scan_3D"
 
     bag_files = glob.glob(os.path.join(source_directory, "*.bag"))
     print(f"Found {len(bag_files)} rosbag(s) to process.")
 
-    for bag_file in bag_files:
-        print(f"Processing {bag_file}...")
-        process_rosbag(bag_file, point_cloud_topic, base_output_directory)
+    keyframes = None
+    if args.keyframes:
+        keyframes = {'centroid_threshold': args.keyframe_centroid, 'bbox_threshold': args.keyframe_bbox,
+                     'cell_size': args.keyframe_cell, 'min_overlap': args.keyframe_overlap,
+                     'translation_threshold': args.keyframe_translation,
+                     'rotation_threshold': math.radians(args.keyframe_rotation),
+                     'max_interval': args.keyframe_max_interval}
+
+    with profiled(args.profile):
+        process_rosbags(bag_files, args.topic, base_output_directory, workers=args.workers,
+                        grand_voxel_size=args.grand_voxel_size, frame_store=args.frame_store,
+                        grand_tile_size=args.grand_tile_size, keyframes=keyframes,
+                        odometry_topic=args.odometry_topic)
+    metrics.report(args.metrics)
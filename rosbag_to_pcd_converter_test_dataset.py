@@ -2,19 +2,9 @@
 
 import rosbag
 import open3d as o3d
-import numpy as np
-import sensor_msgs.point_cloud2 as pc2
 import os
 import glob
-
-def ros_point_cloud2_to_o3d(point_cloud_msg):
-    """
-    Convert a sensor_msgs/PointCloud2 message to an Open3D PointCloud.
-    """
-    points = np.array(list(pc2.read_points(point_cloud_msg, skip_nans=True, field_names=("x", "y", "z"))))
-    o3d_pcd = o3d.geometry.PointCloud()
-    o3d_pcd.points = o3d.utility.Vector3dVector(points)
-    return o3d_pcd
+from pointcloud2_decoder import ros_point_cloud2_to_o3d
 
 def save_processed_point_cloud(o3d_pcd, output_directory, bag_file_name, msg_index):
     """
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import hashlib
+import argparse
+
+MANIFEST_VERSION = 1
+
+def params_hash(params):
+    """Stable hash of a stage's parameters."""
+    encoded = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()
+
+def file_content_hash(path, block_size=1 << 20):
+    """SHA-1 of a file's contents, read in blocks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class StageCache:
+    """
+    On-disk manifest recording which inputs a processing stage has already handled.
+
+    Each entry is keyed by stage name and input path and stores the input's signature,
+    the hash of the stage parameters, the output paths it produced and an optional
+    small result (such as a feature row). An input is skipped when its signature and
+    the parameters are unchanged and all recorded outputs still exist.
+
+    The signature is the file size and modification time. With use_content_hash, the
+    SHA-1 of the contents is used instead; it is only recomputed when size or mtime change.
+    """
+
+    def __init__(self, manifest_path, use_content_hash=False):
+        self.manifest_path = os.path.expanduser(manifest_path)
+        self.use_content_hash = use_content_hash
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.entries = manifest['entries']
+
+    @staticmethod
+    def entry_key(stage, input_path):
+        return f"{stage}:{os.path.abspath(input_path)}"
+
+    def _stat_signature(self, input_path):
+        stat = os.stat(input_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def input_signature(self, input_path, previous=None):
+        """Signature of an input file, reusing the previous content hash when the file is untouched."""
+        stat_signature = self._stat_signature(input_path)
+        if not self.use_content_hash:
+            return {'stat': stat_signature}
+        if previous and previous.get('stat') == stat_signature and previous.get('sha1'):
+            return previous
+        return {'stat': stat_signature, 'sha1': file_content_hash(input_path)}
+
+    def _signatures_match(self, recorded, current):
+        if self.use_content_hash and recorded.get('sha1') and current.get('sha1'):
+            return recorded['sha1'] == current['sha1']
+        return recorded.get('stat') == current.get('stat')
+
+    def lookup(self, stage, input_path, params, outputs=None):
+        """
+        Return the cached entry for this input if it is still valid, otherwise None.
+        When outputs is given, the entry must also have recorded exactly those outputs,
+        so that an output configured since the last run is not skipped.
+        """
+        entry = self.entries.get(self.entry_key(stage, input_path))
+        if (entry is None or entry['params_hash'] != params_hash(params)
+                or (outputs is not None and entry['outputs'] != [os.path.abspath(path) for path in outputs])
+                or not all(os.path.exists(path) for path in entry['outputs'])):
+            self.misses += 1
+            return None
+        current = self.input_signature(input_path, entry['signature'])
+        if not self._signatures_match(entry['signature'], current):
+            self.misses += 1
+            return None
+        entry['signature'] = current
+        entry['last_used'] = time.time()
+        self.hits += 1
+        return entry
+
+    def record(self, stage, input_path, params, outputs=(), result=None):
+        """Record that stage processed input_path with params into outputs."""
+        key = self.entry_key(stage, input_path)
+        previous = self.entries.get(key, {}).get('signature')
+        self.entries[key] = {
+            'stage': stage,
+            'input': os.path.abspath(input_path),
+            'signature': self.input_signature(input_path, previous),
+            'params': params,
+            'params_hash': params_hash(params),
+            'outputs': [os.path.abspath(path) for path in outputs],
+            'result': result,
+            'last_used': time.time(),
+        }
+
+    def save(self):
+        """Write the manifest atomically."""
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def prune(self, stage=None, older_than=None, delete_outputs=False):
+        """
+        Evict stale entries: inputs that were removed or changed, outputs that are missing,
+        and (optionally) entries of one stage or entries unused for older_than seconds.
+        Returns the number of evicted entries.
+        """
+        now = time.time()
+        evicted = []
+        for key, entry in self.entries.items():
+            stale = (not os.path.exists(entry['input'])
+                     or not all(os.path.exists(path) for path in entry['outputs']))
+            if not stale:
+                current = self.input_signature(entry['input'], entry['signature'])
+                stale = not self._signatures_match(entry['signature'], current)
+            if stage is not None and entry['stage'] == stage:
+                stale = True
+            if older_than is not None and now - entry.get('last_used', 0) > older_than:
+                stale = True
+            if stale:
+                evicted.append(key)
+
+        for key in evicted:
+            entry = self.entries.pop(key)
+            if delete_outputs:
+                for path in entry['outputs']:
+                    if os.path.isdir(path):
+                        # Directory outputs (frame stores) are listed after their files
+                        if not os.listdir(path):
+                            os.rmdir(path)
+                    elif os.path.exists(path):
+                        os.remove(path)
+        return len(evicted)
+
+    def summary(self):
+        return f"stage cache: {self.hits} hit(s), {self.misses} miss(es), {len(self.entries)} entries"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clean a stage cache manifest.")
+    parser.add_argument("manifest")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="Show the number of entries per stage")
+    prune_parser = subparsers.add_parser("prune", help="Evict stale entries")
+    prune_parser.add_argument("--stage", help="Also evict every entry of this stage")
+    prune_parser.add_argument("--older-than-days", type=float, help="Also evict entries unused for this many days")
+    prune_parser.add_argument("--delete-outputs", action="store_true", help="Remove the outputs of evicted entries")
+    args = parser.parse_args()
+
+    cache = StageCache(args.manifest)
+    if args.command == "list":
+        stages = {}
+        for entry in cache.entries.values():
+            stages[entry['stage']] = stages.get(entry['stage'], 0) + 1
+        for stage, count in sorted(stages.items()):
+            print(f"{stage}: {count} entries")
+    elif args.command == "prune":
+        older_than = args.older_than_days * 86400 if args.older_than_days is not None else None
+        evicted = cache.prune(stage=args.stage, older_than=older_than, delete_outputs=args.delete_outputs)
+        cache.save()
+        print(f"Evicted {evicted} entries, {len(cache.entries)} remaining")
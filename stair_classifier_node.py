@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+import open3d as o3d
+from pointcloud2_decoder import decode_point_cloud2
+from pcd_filter_passthrough import crop_box_mask
+from pca_feature_engine import compute_features
+from latest_frame_buffer import LatestFrameBuffer
+from train_test_model import load_model, DEFAULT_PREPROCESSING
+from message_replay import replay_bag, replay_synthetic
+
+class LatencyStats:
+    """Rolling window of per-frame latencies with percentile reporting."""
+
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def percentiles(self, quantiles=(50, 90, 99)):
+        if not self.latencies:
+            return {q: float('nan') for q in quantiles}
+        values = np.percentile(np.fromiter(self.latencies, dtype=np.float64), quantiles)
+        return dict(zip(quantiles, values))
+
+    def summary(self):
+        p = self.percentiles()
+        return f"latency p50={p[50] * 1e3:.1f}ms p90={p[90] * 1e3:.1f}ms p99={p[99] * 1e3:.1f}ms"
+
+class StairClassifier:
+    """
+    In-memory version of the offline pipeline for a single PointCloud2 message:
+    decode, crop, optionally voxel-downsample, compute PCA features and score them
+    with a model bundle saved by train_test_model.save_model.
+    """
+
+    def __init__(self, model_bundle, preprocessing=None):
+        self.pipeline = model_bundle['pipeline']
+        self.feature_columns = model_bundle['feature_columns']
+        self.preprocessing = dict(DEFAULT_PREPROCESSING)
+        self.preprocessing.update(model_bundle.get('preprocessing') or {})
+        self.preprocessing.update(preprocessing or {})
+
+    def features(self, msg):
+        points, _ = decode_point_cloud2(msg, extra_fields=())
+        if self.preprocessing['crop_bounds']:
+            points = points[crop_box_mask(points, self.preprocessing['crop_bounds'])]
+        if self.preprocessing['voxel_size'] and len(points):
+            pcd = o3d.geometry.PointCloud()
+            pcd.points = o3d.utility.Vector3dVector(points)
+            points = np.asarray(pcd.voxel_down_sample(self.preprocessing['voxel_size']).points)
+        features = compute_features([points])
+        return pd.DataFrame({name: features[name] for name in self.feature_columns}), len(points)
+
+    def classify(self, msg):
+        """Return the predicted label of one message, or None when no points survive cropping."""
+        features, num_points = self.features(msg)
+        if num_points == 0:
+            return None
+        return int(self.pipeline.predict(features)[0])
+
+class StreamingStairClassifier:
+    """
+    Runs a StairClassifier on a worker thread fed through a LatestFrameBuffer.
+    submit() is safe to call from a subscriber callback; frames that arrive while the
+    worker is busy replace the pending one, so latency stays bounded instead of queuing.
+    """
+
+    def __init__(self, classifier, on_result=None, report_interval=100, log=print):
+        self.classifier = classifier
+        self.on_result = on_result
+        self.report_interval = report_interval
+        self.log = log
+        self.buffer = LatestFrameBuffer()
+        self.stats = LatencyStats()
+        self.processed = 0
+        self.errors = 0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._worker.start()
+        return self
+
+    def submit(self, msg):
+        self.buffer.put((time.perf_counter(), msg))
+
+    def _run(self):
+        while True:
+            item = self.buffer.get()
+            if item is None:
+                if self.buffer.closed:
+                    break
+                continue
+            received_at, msg = item
+            try:
+                label = self.classifier.classify(msg)
+            except Exception as e:
+                self.errors += 1
+                self.log(f"Failed to classify frame: {e}")
+                continue
+            self.stats.add(time.perf_counter() - received_at)
+            self.processed += 1
+            if self.on_result is not None:
+                self.on_result(msg, label)
+            if self.report_interval and self.processed % self.report_interval == 0:
+                self.log(self.report())
+
+    def report(self):
+        return (f"{self.processed} classified, {self.buffer.dropped} dropped of {self.buffer.received} received, "
+                f"{self.stats.summary()}")
+
+    def stop(self):
+        """Finish the pending frame and stop the worker."""
+        self.buffer.close()
+        self._worker.join()
+
+def run_node(streaming, topic_name, output_topic):
+    """Subscribe to the live PointCloud2 topic and publish one label per classified frame."""
+    import rospy
+    from sensor_msgs.msg import PointCloud2
+    from std_msgs.msg import Int8
+
+    rospy.init_node('stair_classifier', anonymous=True)
+    publisher = rospy.Publisher(output_topic, Int8, queue_size=1)
+    streaming.log = rospy.loginfo
+    streaming.on_result = lambda msg, label: label is not None and publisher.publish(Int8(label))
+    # queue_size=1 lets rospy discard stale messages before they even reach the callback
+    rospy.Subscriber(topic_name, PointCloud2, streaming.submit, queue_size=1, buff_size=2 ** 24)
+    rospy.spin()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify PointCloud2 frames as stairs or not in real time.")
+    parser.add_argument("--model", required=True, help="Model bundle saved by train_test_model.py")
+    parser.add_argument("--topic", default="/scan_3D")
+    parser.add_argument("--output-topic", default="/stair_detection")
+    parser.add_argument("--bag", help="Replay this bag instead of subscribing to a live topic")
+    parser.add_argument("--synthetic", type=int, default=0, help="Replay this many synthetic frames instead")
+    parser.add_argument("--rate", type=float, default=1.0, help="Replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--frequency", type=float, default=10.0, help="Synthetic frame rate in Hz")
+    parser.add_argument("--report-interval", type=int, default=100)
+    args = parser.parse_args()
+
+    classifier = StairClassifier(load_model(args.model))
+    streaming = StreamingStairClassifier(classifier, report_interval=args.report_interval).start()
+    if args.bag:
+        replay_bag(args.bag, args.topic, streaming, rate=args.rate)
+    elif args.synthetic:
+        replay_synthetic(streaming, args.synthetic, frequency=args.frequency)
+    else:
+        run_node(streaming, args.topic, args.output_topic)
+    streaming.stop()
+    print(streaming.report())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+from types import SimpleNamespace
+import numpy as np
+
+try:
+    from sensor_msgs.msg import PointCloud2, PointField
+except ImportError:
+    # Without a ROS install, messages are plain namespaces with the PointCloud2 attribute layout
+    PointCloud2 = None
+    PointField = None
+
+FLOAT32 = 7
+UINT16 = 4
+
+def make_floor_cloud(num_points, rng=None, extent=(0.0, 2.5, -0.7, 0.7), height=-0.8, noise=0.005):
+    """Generate a flat floor patch in front of the sensor."""
+    rng = np.random.default_rng(rng)
+    x = rng.uniform(extent[0], extent[1], num_points)
+    y = rng.uniform(extent[2], extent[3], num_points)
+    z = np.full(num_points, height) + rng.normal(0.0, noise, num_points)
+    return np.column_stack((x, y, z))
+
+def make_stair_cloud(num_points, rng=None, num_steps=5, tread=0.28, riser=0.17,
+                     width=1.4, start_x=0.5, floor_height=-0.8, noise=0.005):
+    """
+    Generate a staircase in front of the sensor: alternating horizontal treads and
+    vertical risers, with a short floor section before the first step.
+    """
+    rng = np.random.default_rng(rng)
+    # Split points between treads and risers proportionally to their area
+    num_risers = int(num_points * riser / (tread + riser))
+    num_treads = num_points - num_risers
+
+    step = rng.integers(0, num_steps + 1, num_treads)
+    tx = start_x + step * tread + rng.uniform(0.0, tread, num_treads)
+    tx[step == 0] = rng.uniform(0.0, start_x, np.count_nonzero(step == 0))
+    tz = floor_height + step * riser
+    treads = np.column_stack((tx, rng.uniform(-width / 2, width / 2, num_treads), tz))
+
+    step = rng.integers(0, num_steps, num_risers)
+    rx = start_x + step * tread
+    rz = floor_height + step * riser + rng.uniform(0.0, riser, num_risers)
+    risers = np.column_stack((rx, rng.uniform(-width / 2, width / 2, num_risers), rz))
+
+    points = np.vstack((treads, risers))
+    points += rng.normal(0.0, noise, points.shape)
+    return points[rng.permutation(len(points))]
+
+def make_point_field(name, offset, datatype, count=1):
+    """Create a PointField, or an equivalent namespace when sensor_msgs is unavailable."""
+    if PointField is not None:
+        return PointField(name=name, offset=offset, datatype=datatype, count=count)
+    return SimpleNamespace(name=name, offset=offset, datatype=datatype, count=count)
+
+def make_pointcloud2(points, intensity=None, ring=None, nan_fraction=0.0, rng=None,
+                     frame_id="laser", stamp=None, width=None):
+    """
+    Pack an (N, 3) array into a PointCloud2 laid out like the /scan_3D sensor output:
+    float32 x/y/z/intensity, a uint16 ring and padding up to a 32-byte point_step.
+    A fraction of points can be replaced with NaNs to exercise NaN filtering.
+    """
+    rng = np.random.default_rng(rng)
+    points = np.asarray(points, dtype=np.float32)
+    width = width or len(points)
+    height = len(points) // width if width else 1
+    num_points = width * height
+
+    dtype = np.dtype({'names': ['x', 'y', 'z', 'intensity', 'ring'],
+                      'formats': ['<f4', '<f4', '<f4', '<f4', '<u2'],
+                      'offsets': [0, 4, 8, 16, 20],
+                      'itemsize': 32})
+    cloud = np.zeros(num_points, dtype=dtype)
+    cloud['x'], cloud['y'], cloud['z'] = points[:num_points].T
+    cloud['intensity'] = intensity[:num_points] if intensity is not None else rng.uniform(0, 255, num_points)
+    cloud['ring'] = ring[:num_points] if ring is not None else np.arange(num_points) % 16
+    if nan_fraction > 0:
+        nan_idx = rng.choice(num_points, int(num_points * nan_fraction), replace=False)
+        cloud['x'][nan_idx] = np.nan
+
+    fields = [make_point_field('x', 0, FLOAT32),
+              make_point_field('y', 4, FLOAT32),
+              make_point_field('z', 8, FLOAT32),
+              make_point_field('intensity', 16, FLOAT32),
+              make_point_field('ring', 20, UINT16)]
+    attributes = dict(height=height, width=width, fields=fields,
+                      is_bigendian=False, point_step=dtype.itemsize,
+                      row_step=dtype.itemsize * width,
+                      data=cloud.tobytes(), is_dense=nan_fraction == 0)
+    if PointCloud2 is not None:
+        msg = PointCloud2(**attributes)
+        msg.header.frame_id = frame_id
+        if stamp is not None:
+            msg.header.stamp = stamp
+        return msg
+    attributes['header'] = SimpleNamespace(frame_id=frame_id, stamp=stamp, seq=0)
+    return SimpleNamespace(**attributes)
+
+def make_labelled_frames(num_frames, points_per_frame, rng=None):
+    """Alternate stair and floor frames; returns the point arrays and their labels (1 = stairs)."""
+    rng = np.random.default_rng(rng)
+    frames, labels = [], []
+    for index in range(num_frames):
+        is_stairs = index % 2 == 0
+        make_cloud = make_stair_cloud if is_stairs else make_floor_cloud
+        frames.append(make_cloud(points_per_frame, rng=rng))
+        labels.append(int(is_stairs))
+    return frames, labels
+
+def write_synthetic_bag(bag_path, num_frames, points_per_frame, topic_name="/scan_3D",
+                        frequency=10.0, start_time=1_700_000_000.0, rng=None):
+    """
+    Write a small bag of synthetic PointCloud2 frames on topic_name at a fixed rate.
+    Only needs the rosbag and sensor_msgs Python packages, not a running ROS master.
+    """
+    import rosbag
+    import genpy
+
+    rng = np.random.default_rng(rng)
+    frames, _ = make_labelled_frames(num_frames, points_per_frame, rng=rng)
+    with rosbag.Bag(bag_path, 'w') as bag:
+        for index, points in enumerate(frames):
+            stamp = genpy.Time.from_sec(start_time + index / frequency)
+            bag.write(topic_name, make_pointcloud2(points, rng=rng, stamp=stamp), stamp)
+    return bag_path
@@ -1,22 +1,68 @@
 import os
+import json
+import time
+import glob
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.preprocessing import StandardScaler
+from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.svm import SVC
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, accuracy_score
+from feature_store import load_features
+from stage_cache import file_content_hash
 
-def load_data(data_path):
-    """Load data from a CSV file."""
-    return pd.read_csv(data_path)
+# Candidate models and the hyperparameter grid searched for each
+MODEL_SEARCH_SPACE = {
+    "Random Forest": (RandomForestClassifier, {'n_estimators': [100, 300], 'max_depth': [None, 10], 'random_state': [42]}),
+    "SVM": (SVC, {'kernel': ['linear', 'rbf'], 'C': [0.1, 1.0, 10.0], 'random_state': [42]}),
+    "Logistic Regression": (LogisticRegression, {'C': [0.1, 1.0, 10.0], 'max_iter': [1000], 'random_state': [42]}),
+}
+
+# Point cloud preprocessing of the default feature CSV (the x pass-through filter). It is
+# recorded in saved model bundles, and used for bundles that do not record their own.
+DEFAULT_PREPROCESSING = {'crop_bounds': {'x': [0.0, 2.5]}, 'voxel_size': None}
+
+def resolve_preprocessing(pipeline_config=None, crop_bounds=None, voxel_size=None):
+    """
+    The preprocessing the training features were computed with, to be applied again
+    at inference: the stages of a pcd_processing_pipeline config when one is given,
+    otherwise DEFAULT_PREPROCESSING, with crop_bounds and voxel_size overriding either.
+    An empty crop_bounds dict means no crop.
+    """
+    preprocessing = json.loads(json.dumps(DEFAULT_PREPROCESSING))
+    if pipeline_config:
+        from pcd_processing_pipeline import load_config
+        config = load_config(pipeline_config)
+        preprocessing = {'crop_bounds': config['passthrough_bounds'] or {}, 'voxel_size': config['voxel_size']}
+    if crop_bounds is not None:
+        preprocessing['crop_bounds'] = crop_bounds
+    if voxel_size is not None:
+        preprocessing['voxel_size'] = voxel_size or None
+    return preprocessing
+
+def load_data(data_path, columns=None):
+    """
+    Load data from a CSV file, or from a columnar feature store directory.
+    With a feature store only the requested columns are read.
+    """
+    if os.path.isdir(data_path):
+        return load_features(data_path, columns=columns)
+    return pd.read_csv(data_path, usecols=columns)
 
 def scale_features(X_train, X_test):
     """Scale features using standardization."""
     scaler = StandardScaler()
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
-    return X_train_scaled, X_test_scaled
+    return X_train_scaled, X_test_scaled, scaler
 
 def train_and_evaluate_model(model, X_train, y_train, X_test, y_test, model_name):
     """Train a model and evaluate it on the test set."""
@@ -27,30 +73,206 @@ def train_and_evaluate_model(model, X_train, y_train, X_test, y_test, model_name
     print("Classification Report:")
     print(classification_report(y_test, predictions))
     print("-" * 60)
+    return model
 
-# Define the path to your dataset
-data_path = 'C:/Users/shovo/OneDrive - University of Waterloo/Documents/NRE Lab/LIDAR Research/Pattern Recognition Course Project/syde_675_data/features_csv_files/csv_filtered_depth/pca_features_with_labels.csv'
+def save_model(scaler, model, feature_columns, model_path, model_name=None, preprocessing=None):
+    """
+    Persist a fitted scaler and classifier as one pipeline, together with the feature
+    column order and the point cloud preprocessing the features were computed with.
+    """
+    bundle = {
+        'pipeline': Pipeline([('scaler', scaler), ('model', model)]),
+        'feature_columns': list(feature_columns),
+        'model_name': model_name,
+        'preprocessing': preprocessing or {},
+    }
+    directory = os.path.dirname(model_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    joblib.dump(bundle, model_path)
+    print(f"Saved model to {model_path}")
 
-# Load the data
-data = load_data(data_path)
+def load_model(model_path):
+    """Load a model bundle written by save_model."""
+    return joblib.load(os.path.expanduser(model_path))
 
-# Split the data into features and labels
-X = data.drop('label', axis=1)
-y = data['label']
+def feature_data_version(data_path):
+    """Content hash identifying a feature CSV file or feature store directory."""
+    if not os.path.isdir(data_path):
+        return file_content_hash(data_path)[:16]
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(data_path, '*', 'part-*'))):
+        digest.update(os.path.relpath(path, data_path).encode())
+        digest.update(file_content_hash(path).encode())
+    return digest.hexdigest()[:16]
 
-# Split the data into training and testing sets
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+def expand_search_space(search_space):
+    """List every (model_name, params) candidate of a search space."""
+    candidates = []
+    for model_name, (estimator, grid) in search_space.items():
+        names = sorted(grid)
+        for values in itertools.product(*(grid[name] for name in names)):
+            candidates.append((model_name, dict(zip(names, values))))
+    return candidates
 
-# Scale the features
-X_train_scaled, X_test_scaled = scale_features(X_train, X_test)
+# Training data shared with the worker processes once, instead of with every task
+_worker_data = {}
 
-# Models to train
-models = {
-    "Random Forest": RandomForestClassifier(n_estimators=100, random_state=42),
-    "SVM": SVC(kernel='linear', random_state=42),
-    "Logistic Regression": LogisticRegression(random_state=42, max_iter=1000)
-}
+def _init_search_worker(X, y):
+    _worker_data['X'] = X
+    _worker_data['y'] = y
+
+def _load_fold_cache(cache_path):
+    """The cached fit of one fold, or None when it is missing or cannot be read."""
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        return joblib.load(cache_path)
+    except Exception:
+        # E.g. a file truncated by an older, interrupted run; it is simply refitted
+        return None
+
+def _save_fold_cache(cache_path, fitted):
+    """Dump to a temporary file and rename it, so an interrupted run leaves no partial file."""
+    tmp_path = os.path.join(os.path.dirname(cache_path), f".{os.path.basename(cache_path)}.{os.getpid()}.tmp")
+    joblib.dump(fitted, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+def _evaluate_fold(task):
+    """Fit (or load from cache) one candidate on one fold and time training and inference."""
+    model_name, estimator, params, fold, train_idx, test_idx, cache_path = task
+    X, y = _worker_data['X'], _worker_data['y']
+    cached = _load_fold_cache(cache_path)
+    if cached is not None:
+        scaler, model, train_seconds = cached['scaler'], cached['model'], cached['train_seconds']
+        from_cache = True
+    else:
+        start = time.perf_counter()
+        scaler = StandardScaler().fit(X[train_idx])
+        model = estimator(**params).fit(scaler.transform(X[train_idx]), y[train_idx])
+        train_seconds = time.perf_counter() - start
+        from_cache = False
+        if cache_path:
+            _save_fold_cache(cache_path, {'scaler': scaler, 'model': model, 'train_seconds': train_seconds})
+
+    start = time.perf_counter()
+    predictions = model.predict(scaler.transform(X[test_idx]))
+    inference_seconds = time.perf_counter() - start
+    return {
+        'model': model_name,
+        'params': json.dumps(params, sort_keys=True),
+        'fold': fold,
+        'accuracy': accuracy_score(y[test_idx], predictions),
+        'train_seconds': train_seconds,
+        'inference_us_per_frame': inference_seconds / len(test_idx) * 1e6,
+        'from_cache': from_cache,
+    }
+
+def search_models(data_path, folds=5, workers=None, cache_dir=None, model_path=None,
+                  search_space=MODEL_SEARCH_SPACE, preprocessing=None):
+    """
+    Cross-validate every candidate of search_space with stratified k-fold over a process
+    pool. Fitted fold scalers and models are cached under cache_dir, keyed by the feature
+    data version, so a rerun on unchanged data only recomputes new candidates. The best
+    candidate by mean accuracy is refit on all data and saved to model_path.
+    Returns one row per candidate with accuracy and timing statistics.
+    """
+    data = load_data(data_path)
+    feature_columns = [column for column in data.columns if column != 'label']
+    X = data[feature_columns].to_numpy(dtype=np.float64)
+    y = data['label'].to_numpy()
+
+    version = feature_data_version(data_path)
+    version_cache_dir = os.path.join(cache_dir, version) if cache_dir else None
+    if version_cache_dir:
+        os.makedirs(version_cache_dir, exist_ok=True)
+
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=42).split(X, y))
+    tasks = []
+    for model_name, params in expand_search_space(search_space):
+        params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+        for fold, (train_idx, test_idx) in enumerate(splits):
+            cache_path = None
+            if version_cache_dir:
+                file_name = f"{model_name.lower().replace(' ', '_')}_{params_key}_k{folds}_fold{fold}.joblib"
+                cache_path = os.path.join(version_cache_dir, file_name)
+            tasks.append((model_name, search_space[model_name][0], params, fold, train_idx, test_idx, cache_path))
+
+    print(f"Evaluating {len(tasks) // folds} candidate(s) x {folds} folds on {len(y)} rows (data version {version})")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker, initargs=(X, y)) as executor:
+        fold_results = pd.DataFrame(list(executor.map(_evaluate_fold, tasks)))
+    print(f"Cross-validation took {time.perf_counter() - start:.1f}s "
+          f"({int(fold_results['from_cache'].sum())} of {len(fold_results)} folds loaded from cache)")
+
+    results = (fold_results.groupby(['model', 'params'])
+               .agg(accuracy_mean=('accuracy', 'mean'), accuracy_std=('accuracy', 'std'),
+                    train_seconds=('train_seconds', 'mean'),
+                    inference_us_per_frame=('inference_us_per_frame', 'mean'))
+               .reset_index()
+               .sort_values(['accuracy_mean', 'inference_us_per_frame'], ascending=[False, True]))
+    with pd.option_context('display.max_colwidth', 80, 'display.width', 200):
+        print(results.to_string(index=False))
+
+    if model_path:
+        best = results.iloc[0]
+        params = json.loads(best['params'])
+        print(f"Refitting best model {best['model']} {params} on all data")
+        scaler = StandardScaler().fit(data[feature_columns])
+        model = search_space[best['model']][0](**params)
+        model.fit(scaler.transform(data[feature_columns]), y)
+        save_model(scaler, model, feature_columns, model_path, best['model'], preprocessing)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and evaluate stair classifiers on PCA features.")
+    parser.add_argument("--data", help="Feature CSV file or feature store directory")
+    parser.add_argument("--search", action="store_true", help="Run the cross-validated model search")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="Processes used by the search")
+    parser.add_argument("--pipeline-config", help="pcd_processing_pipeline config the features were computed with")
+    parser.add_argument("--crop-bounds", type=json.loads,
+                        help='Crop the features were computed after as JSON, such as \'{"x": [0, 2.5]}\'; {} for none')
+    parser.add_argument("--voxel-size", type=float, help="Voxel size the features were computed after, 0 for none")
+    args = parser.parse_args()
+
+    # Define the path to your dataset
+    data_path = args.data or 'C:/Users/shovo/OneDrive - University of Waterloo/Documents/NRE Lab/LIDAR Research/Pattern Recognition Course Project/syde_675_data/features_csv_files/csv_filtered_depth/pca_features_with_labels.csv'
+    data_path = os.path.expanduser(data_path)
+    # Fitted models are saved here so inference does not need to retrain
+    model_dir = os.path.join(os.path.dirname(os.path.normpath(data_path)), 'models')
+    # Preprocessing applied before the features in data_path were computed
+    preprocessing = resolve_preprocessing(args.pipeline_config, args.crop_bounds, args.voxel_size)
+    print(f"Saved models record the preprocessing {preprocessing}")
+
+    if args.search:
+        search_models(data_path, folds=args.folds, workers=args.workers,
+                      cache_dir=os.path.join(model_dir, 'cv_cache'),
+                      model_path=os.path.join(model_dir, 'best_model.joblib'),
+                      preprocessing=preprocessing)
+    else:
+        # Load the data
+        data = load_data(data_path)
+
+        # Split the data into features and labels
+        X = data.drop('label', axis=1)
+        y = data['label']
+
+        # Split the data into training and testing sets
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+        # Scale the features
+        X_train_scaled, X_test_scaled, scaler = scale_features(X_train, X_test)
+
+        # Models to train
+        models = {
+            "Random Forest": RandomForestClassifier(n_estimators=100, random_state=42),
+            "SVM": SVC(kernel='linear', random_state=42),
+            "Logistic Regression": LogisticRegression(random_state=42, max_iter=1000)
+        }
 
-# Train and evaluate each model
-for model_name, model in models.items():
-    train_and_evaluate_model(model, X_train_scaled, y_train, X_test_scaled, y_test, model_name)
\ No newline at end of file
+        # Train and evaluate each model
+        for model_name, model in models.items():
+            train_and_evaluate_model(model, X_train_scaled, y_train, X_test_scaled, y_test, model_name)
+            model_file = model_name.lower().replace(' ', '_') + '.joblib'
+            save_model(scaler, model, X.columns, os.path.join(model_dir, model_file), model_name, preprocessing)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+VOXEL_MODES = ('centroid', 'first', 'random')
+
+def _frame_voxel_keys(point_sets, voxel_sizes):
+    """
+    One int64 key per point that is unique per (frame, voxel) and sorts by frame first.
+
+    Voxels are anchored like Open3D's voxel_down_sample: at each frame's minimum bound
+    minus half a voxel. Each frame's voxel indices are numbered densely inside the
+    frame's own index box, and frames are stacked one after another in the key space.
+    Returns the concatenated points, their keys and frame ids, and the points per frame.
+    """
+    counts = np.array([len(points) for points in point_sets], dtype=np.int64)
+    points = np.concatenate([np.asarray(p, dtype=np.float64).reshape(-1, 3) for p in point_sets])
+    frame_ids = np.repeat(np.arange(len(point_sets)), counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    nonempty = counts > 0
+    min_bounds = np.zeros((len(point_sets), 3))
+    min_bounds[nonempty] = np.minimum.reduceat(points, starts[nonempty], axis=0)
+    sizes = voxel_sizes[:, None]
+    origins = min_bounds - sizes * 0.5
+    indices = np.floor((points - origins[frame_ids]) / sizes[frame_ids]).astype(np.int64)
+
+    dims = np.ones((len(point_sets), 3), dtype=np.int64)
+    if len(points):
+        max_index = np.zeros((len(point_sets), 3), dtype=np.int64)
+        max_index[nonempty] = np.maximum.reduceat(indices, starts[nonempty], axis=0)
+        dims = max_index + 1
+    volumes = dims.prod(axis=1, dtype=np.float64)
+    if volumes.sum() >= 2 ** 62:
+        raise ValueError("Voxel size is too small for the extent of the point clouds")
+    frame_offsets = np.concatenate(([0], np.cumsum(dims.prod(axis=1))[:-1]))
+    keys = (frame_offsets[frame_ids]
+            + (indices[:, 0] * dims[frame_ids, 1] + indices[:, 1]) * dims[frame_ids, 2] + indices[:, 2])
+    return points, keys, frame_ids, counts
+
+def _per_frame_sizes(voxel_size, num_frames):
+    sizes = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (num_frames,)).copy()
+    if np.any(sizes <= 0):
+        raise ValueError("Voxel size must be positive")
+    return sizes
+
+def voxel_downsample_batch(point_sets, voxel_size, mode='centroid', rng=None):
+    """
+    Voxel-grid downsample a list of (N, 3) frames in one vectorized pass.
+
+    voxel_size is a single size or one size per frame. mode selects the point kept
+    for each occupied voxel: 'centroid' averages its points (as Open3D's
+    voxel_down_sample does), 'first' keeps the first point in input order and
+    'random' keeps a random one. Returns one (M, 3) float64 array per frame, with
+    the voxels in index order rather than Open3D's hash-map order.
+    """
+    if mode not in VOXEL_MODES:
+        raise ValueError(f"mode must be one of {VOXEL_MODES}")
+    if len(point_sets) == 0:
+        return []
+    sizes = _per_frame_sizes(voxel_size, len(point_sets))
+    points, keys, frame_ids, _ = _frame_voxel_keys(point_sets, sizes)
+    if len(points) == 0:
+        return [np.empty((0, 3)) for _ in point_sets]
+
+    if mode == 'centroid':
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        voxel_counts = np.bincount(inverse)
+        kept = np.column_stack([np.bincount(inverse, weights=points[:, axis]) for axis in range(3)])
+        kept /= voxel_counts[:, None]
+    else:
+        order = np.arange(len(points))
+        if mode == 'random':
+            order = np.random.default_rng(rng).permutation(len(points))
+        _, first_in_order = np.unique(keys[order], return_index=True)
+        first = order[first_in_order]
+        kept = points[first]
+
+    # Voxels are sorted by key, and keys sort by frame, so each frame is one slice
+    voxels_per_frame = np.bincount(frame_ids[first], minlength=len(point_sets))
+    return np.split(kept, np.cumsum(voxels_per_frame)[:-1])
+
+def voxel_downsample(points, voxel_size, mode='centroid', rng=None):
+    """voxel_downsample_batch for a single frame."""
+    return voxel_downsample_batch([points], voxel_size, mode, rng)[0]
+
+def voxel_counts(point_sets, voxel_size):
+    """Number of occupied voxels in each frame, i.e. the downsampled point counts."""
+    sizes = _per_frame_sizes(voxel_size, len(point_sets))
+    _, keys, frame_ids, _ = _frame_voxel_keys(point_sets, sizes)
+    _, first = np.unique(keys, return_index=True)
+    return np.bincount(frame_ids[first], minlength=len(point_sets))
+
+def voxel_sizes_for_target(point_sets, target_points, min_size=1e-3, iterations=20, tolerance=0.05):
+    """
+    Find for each frame the voxel size that leaves about target_points points.
+
+    All frames are searched together: every iteration counts the occupied voxels of
+    the whole batch in one call and halves each frame's bracket in log space. The
+    search stops once every frame is within tolerance (a fraction of target_points)
+    or after the given number of iterations. Frames that already have no more than
+    target_points points need no downsampling and get NaN. The returned size is the
+    closest of the sizes tried.
+    """
+    num_frames = len(point_sets)
+    counts = np.array([len(points) for points in point_sets])
+    extents = np.array([np.ptp(np.asarray(points).reshape(-1, 3), axis=0).max() if len(points) else 0.0
+                        for points in point_sets])
+    low = np.full(num_frames, np.log(min_size))
+    high = np.log(np.maximum(extents, min_size) * 2)
+    best_sizes = np.full(num_frames, np.nan)
+    best_errors = np.full(num_frames, np.inf)
+    active = counts > target_points
+
+    for _ in range(iterations):
+        if not active.any():
+            break
+        frames = np.flatnonzero(active)
+        middle = (low[frames] + high[frames]) / 2
+        sizes = np.exp(middle)
+        found = voxel_counts([point_sets[i] for i in frames], sizes)
+        errors = np.abs(found - target_points)
+
+        improved = errors < best_errors[frames]
+        best_sizes[frames[improved]] = sizes[improved]
+        best_errors[frames[improved]] = errors[improved]
+        # More voxels than wanted means the voxels are too small
+        too_small = found > target_points
+        low[frames[too_small]] = middle[too_small]
+        high[frames[~too_small]] = middle[~too_small]
+        active[frames[errors <= tolerance * target_points]] = False
+    return best_sizes
+
+def voxel_downsample_to_target(point_sets, target_points, mode='centroid', rng=None, **search_options):
+    """
+    Downsample each frame to about target_points points (see voxel_sizes_for_target).
+    Returns the downsampled frames and the voxel size used for each; frames that
+    already have no more than target_points points are returned unchanged, with size NaN.
+    """
+    sizes = voxel_sizes_for_target(point_sets, target_points, **search_options)
+    frames = np.flatnonzero(~np.isnan(sizes))
+    downsampled = [np.asarray(points) for points in point_sets]
+    for i, points in zip(frames, voxel_downsample_batch([point_sets[i] for i in frames], sizes[frames], mode, rng)):
+        downsampled[i] = points
+    return downsampled, sizes